@@ -9,9 +9,15 @@ https://docs.djangoproject.com/en/5.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
+from datetime import timedelta
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -76,11 +82,70 @@ WSGI_APPLICATION = 'DjangoProject.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Worker commands keep one connection per worker thread (or worker process)
+# for the life of the process, so a pool would only cap how many workers can
+# run; they use plain persistent connections instead.
+WORKER_COMMANDS = ('run_worker', 'run_worker_pools', 'run_scheduler')
+IS_WORKER_PROCESS = len(sys.argv) > 1 and sys.argv[1] in WORKER_COMMANDS
+
+DB_ENGINE = config('DB_ENGINE', default='sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DB_POOL = config('DB_POOL', default=False, cast=bool) and not IS_WORKER_PROCESS
+    DB_POOL_MIN_SIZE = config('DB_POOL_MIN_SIZE', default=2, cast=int)
+    DB_POOL_MAX_SIZE = config('DB_POOL_MAX_SIZE', default=10, cast=int)
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='invoices'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default=''),
+            'HOST': config('DB_HOST', default='localhost'),
+            'PORT': config('DB_PORT', default=5432, cast=int),
+            # Django refuses persistent connections together with a pool; the
+            # pool itself keeps the connections open.
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+            'OPTIONS': {},
+        }
     }
+    if DB_POOL:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+            # Reusing connections also skips re-applying SQLITE_PRAGMAS per request.
+            'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+            'OPTIONS': {
+                # Seconds a connection waits on a locked database before raising
+                # "database is locked".
+                'timeout': config('SQLITE_TIMEOUT', default=20, cast=int),
+                # Take the write lock when the transaction starts instead of on
+                # the first write, so concurrent writers queue on the busy timeout
+                # rather than failing on a read -> write lock upgrade.
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported DB_ENGINE {DB_ENGINE!r}, expected 'sqlite' or 'postgresql'.")
+
+# Applied to every new SQLite connection by invoices.signals.
+SQLITE_PRAGMAS = {
+    'journal_mode': config('SQLITE_JOURNAL_MODE', default='WAL'),
+    'synchronous': config('SQLITE_SYNCHRONOUS', default='NORMAL'),
+    'busy_timeout': config('SQLITE_TIMEOUT', default=20, cast=int) * 1000,
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=128 * 1024 * 1024, cast=int),
+    'cache_size': config('SQLITE_CACHE_SIZE', default=-20000, cast=int),
+    'temp_store': 'MEMORY',
 }
 
 
@@ -120,6 +185,39 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Generated files (invoice PDFs, reports, e-mail logs, communication history)
+# go through the 'invoice_files' storage, which shards them into nested
+# directories. FILE_STORAGE=s3 stores them in an S3-compatible bucket instead
+# (needs django-storages[s3]); set AWS_S3_ENDPOINT_URL for MinIO or a local stand-in.
+FILE_STORAGE = config('FILE_STORAGE', default='local')
+if FILE_STORAGE == 'local':
+    INVOICE_FILES_STORAGE = {
+        'BACKEND': 'invoices.storage.ShardedFileSystemStorage',
+        'OPTIONS': {
+            'location': config('FILE_STORAGE_ROOT', default=str(BASE_DIR)),
+        },
+    }
+elif FILE_STORAGE == 's3':
+    INVOICE_FILES_STORAGE = {
+        'BACKEND': 'invoices.storage_s3.ShardedS3Storage',
+        'OPTIONS': {
+            'bucket_name': config('AWS_STORAGE_BUCKET_NAME'),
+            'endpoint_url': config('AWS_S3_ENDPOINT_URL', default=None),
+            'region_name': config('AWS_S3_REGION_NAME', default=None),
+            'access_key': config('AWS_ACCESS_KEY_ID', default=None),
+            'secret_key': config('AWS_SECRET_ACCESS_KEY', default=None),
+            'location': config('FILE_STORAGE_PREFIX', default=''),
+        },
+    }
+else:
+    raise ImproperlyConfigured(f"Unsupported FILE_STORAGE '{FILE_STORAGE}' (expected 'local' or 's3')")
+
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+    'invoice_files': INVOICE_FILES_STORAGE,
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -134,68 +232,170 @@ EMAIL_USE_TLS    = config('EMAIL_USE_TLS', default=False, cast=bool)
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default=config('EMAIL_HOST_USER'))
 RECIPIENT_EMAIL  = config('RECIPIENT_EMAIL')
 
+PROCESS_NAME = sys.argv[1] if len(sys.argv) > 1 and os.path.basename(sys.argv[0]) == 'manage.py' else 'web'
+
+# `manage.py test` writes its logs and task metrics to a scratch directory,
+# removed at exit, instead of LOG_DIR and TASK_METRICS_FILE.
+TEST_OUTPUT_DIR = tempfile.mkdtemp(prefix='invoices-test-') if PROCESS_NAME == 'test' else None
+if TEST_OUTPUT_DIR:
+    atexit.register(shutil.rmtree, TEST_OUTPUT_DIR, ignore_errors=True)
+
+# Logging goes through invoices.log.AsyncHandler: callers only enqueue records,
+# a listener thread formats and writes them. A process started from the command
+# line writes and rotates LOG_DIR/<LOG_NAME>.log, named after its role (the
+# management command, or 'web'); forked children (task processes, process
+# workers) send their records to that process's listener over a pipe. Give
+# concurrent processes of the same role their own LOG_NAME.
+LOG_DIR = TEST_OUTPUT_DIR or config('LOG_DIR', default=str(BASE_DIR / 'logs'))
+LOG_NAME = config('LOG_NAME', default=PROCESS_NAME)
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
-    "formatters": {
-        "verbose": {
-            "format": "{asctime} - {levelname} - {name} - {message}",
-            "style": "{",
-        },
-        "simple": {
-            "format": "{levelname} - {message}",
-            "style": "{",
-        },
-    },
     "handlers": {
-        "console": {
-            "level": "DEBUG",
-            "class": "logging.StreamHandler",
-            "formatter": "simple",
-        },
-        "file": {
-            "level": "INFO",
-            "class": "logging.FileHandler",
-            "filename": "task_worker.log",
-            "formatter": "verbose",
+        "async": {
+            "()": "invoices.log.AsyncHandler",
+            "filename": os.path.join(LOG_DIR, f"{LOG_NAME}.log"),
+            "json_format": LOG_FORMAT == 'json',
+            "console": config('LOG_CONSOLE', default=True, cast=bool),
+            "max_bytes": config('LOG_MAX_BYTES', default=50 * 1024 * 1024, cast=int),
+            "backup_count": config('LOG_BACKUP_COUNT', default=5, cast=int),
         },
     },
     "loggers": {
         "django": {
-            "handlers": ["console", "file"],
+            "handlers": ["async"],
             "level": "INFO",
             "propagate": True,
         },
         "task_worker": {
-            "handlers": ["console", "file"],
-            "level": "DEBUG",
+            "handlers": ["async"],
+            "level": LOG_LEVEL,
             "propagate": False,
         },
         "task_scheduler": {
-            "handlers": ["console", "file"],
-            "level": "DEBUG",
+            "handlers": ["async"],
+            "level": LOG_LEVEL,
             "propagate": False,
         },
         "django_async_manager.worker": {
-            "handlers": ["console", "file"],
-            "level": "DEBUG",
+            "handlers": ["async"],
+            "level": LOG_LEVEL,
             "propagate": False,
         },
         "django_async_manager.scheduler": {
-            "handlers": ["console", "file"],
-            "level": "DEBUG",
+            "handlers": ["async"],
+            "level": LOG_LEVEL,
             "propagate": False,
         },
     },
 }
 
 
-BEAT_SCHEDULE = {
+# Worker pools started by `manage.py run_worker_pools`, one per queue.
+# `processes` runs the pool's workers as processes instead of threads. On
+# SQLite every pool runs processes regardless (see invoices.autoscale.threads_fork_safely).
+TASK_QUEUES = {
+    'invoices.render': {
+        'workers': config('RENDER_WORKERS', default=2, cast=int),
+        'processes': config('RENDER_WORKER_PROCESSES', default=DB_ENGINE == 'sqlite', cast=bool),
+        # Imported once by run_worker_pools so forked task processes inherit it
+        # instead of paying reportlab's import on every PDF.
+        'preload': ['invoices.rendering'],
+        # Bounds for run_worker_pools --adaptive; CPU-bound queues also stop at the core count.
+        'min_workers': 1,
+        'max_workers': config('RENDER_MAX_WORKERS', default=os.cpu_count() or 1, cast=int),
+    },
+    'invoices.mail': {
+        'workers': config('MAIL_WORKERS', default=4, cast=int),
+        'processes': config('MAIL_WORKER_PROCESSES', default=DB_ENGINE == 'sqlite', cast=bool),
+        'min_workers': 1,
+        'max_workers': config('MAIL_MAX_WORKERS', default=32, cast=int),
+    },
+    'invoices.bookkeeping': {
+        'workers': config('BOOKKEEPING_WORKERS', default=1, cast=int),
+        'processes': config('BOOKKEEPING_WORKER_PROCESSES', default=DB_ENGINE == 'sqlite', cast=bool),
+        'min_workers': 1,
+        'max_workers': config('BOOKKEEPING_MAX_WORKERS', default=4, cast=int),
+    },
+}
+
+# Adaptive worker pools (run_worker_pools --adaptive, see invoices.autoscale).
+TASK_AUTOSCALE = {
+    # Seconds between sizing decisions.
+    'interval': config('AUTOSCALE_INTERVAL', default=15, cast=int),
+    # Seconds an idle worker waits before polling its queue again.
+    'poll_interval': config('AUTOSCALE_POLL_INTERVAL', default=1.0, cast=float),
+    # Completed tasks from this many seconds back make up a queue's cost profile.
+    'profile_window': config('AUTOSCALE_PROFILE_WINDOW', default=900, cast=int),
+    # Queues spending at least this share of wall time on CPU are capped at the core count.
+    'cpu_bound_ratio': config('AUTOSCALE_CPU_BOUND_RATIO', default=0.5, cast=float),
+    # Defaults for queues without min_workers / max_workers.
+    'min_workers': 1,
+    'max_workers': 8,
+}
+
+# Per-stage task timings, merged here by every worker process (see invoices.metrics).
+if TEST_OUTPUT_DIR:
+    TASK_METRICS_FILE = os.path.join(TEST_OUTPUT_DIR, 'task_metrics.json')
+else:
+    TASK_METRICS_FILE = config('TASK_METRICS_FILE', default=str(BASE_DIR / 'metrics' / 'task_metrics.json'))
+
+# Finished tasks older than this are moved to invoices.TaskArchive by archive_old_tasks.
+TASK_ARCHIVE_RETENTION_DAYS = config('TASK_ARCHIVE_RETENTION_DAYS', default=14, cast=int)
+TASK_ARCHIVE_CHUNK_SIZE = config('TASK_ARCHIVE_CHUNK_SIZE', default=1000, cast=int)
+
+# Bulk invoice ingest: valid rows are handed to a bulk generation task in
+# chunks of this size, and a single row larger than the limit is rejected.
+BULK_INGEST_CHUNK_SIZE = config('BULK_INGEST_CHUNK_SIZE', default=500, cast=int)
+BULK_INGEST_MAX_ROW_BYTES = config('BULK_INGEST_MAX_ROW_BYTES', default=64 * 1024, cast=int)
+
+# Invoices fetched per query by the streaming export.
+INVOICE_EXPORT_PAGE_SIZE = config('INVOICE_EXPORT_PAGE_SIZE', default=1000, cast=int)
+
+# PDF archives: invoices handled per page, and processes rendering missing PDFs.
+PDF_ARCHIVE_CHUNK_SIZE = config('PDF_ARCHIVE_CHUNK_SIZE', default=200, cast=int)
+PDF_ARCHIVE_RENDER_PROCESSES = config('PDF_ARCHIVE_RENDER_PROCESSES', default=os.cpu_count() or 1, cast=int)
+
+# Jobs that receive their logical schedule time (logical_time, plus window_start =
+# logical_time - window). The run ledger (invoices.PeriodicJobRun) enqueues each
+# slot once, backfills up to `catchup` missed slots after an outage, and splits
+# jobs with `shard_rows` into one task per shard_rows invoices of the window.
+PERIODIC_JOBS = {
     'daily-invoice-report': {
         'task': 'invoices.tasks.generate_daily_invoice_report',
+        'cron': '40 15 * * *',
+        'window': timedelta(days=1),
+        'catchup': 7,
+    },
+    'hourly-invoice-summary': {
+        'task': 'invoices.tasks.summarize_invoices',
+        'cron': '0 * * * *',
+        'window': timedelta(hours=1),
+        'catchup': 48,
+        'shard_rows': config('SUMMARY_SHARD_ROWS', default=5000, cast=int),
+        'max_shards': 16,
+    },
+}
+
+BEAT_SCHEDULE = {
+    # Fires the jobs in PERIODIC_JOBS; safe to run from several scheduler replicas.
+    'periodic-jobs': {
+        'task': 'invoices.tasks.dispatch_periodic_jobs',
+        'schedule': {
+            'hour': '*',
+            'minute': '*',
+        },
+        'args': [],
+        'kwargs': {},
+    },
+    'archive-tasks': {
+        'task': 'invoices.tasks.archive_old_tasks',
         'schedule': {
-            'hour': '15',
-            'minute': '40',
+            'hour': '3',
+            'minute': '15',
         },
         'args': [],
         'kwargs': {},
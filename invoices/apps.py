@@ -1,6 +1,16 @@
+import os
+
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class InvoicesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'invoices'
+
+    def ready(self):
+        from .signals import configure_sqlite_connection, discard_inherited_connections
+
+        connection_created.connect(configure_sqlite_connection, dispatch_uid='invoices.sqlite_pragmas')
+        # Tasks, seeding chunks and archive renders run in forked processes.
+        os.register_at_fork(after_in_child=discard_inherited_connections)
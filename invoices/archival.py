@@ -0,0 +1,67 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django_async_manager.models import Task
+
+from invoices.models import TaskArchive
+
+logger = logging.getLogger('task_worker')
+
+FINAL_STATUSES = ('completed', 'failed', 'canceled')
+ACTIVE_STATUSES = ('pending', 'in_progress')
+
+
+def archivable_tasks(cutoff):
+    # A finished task that a pending task still depends on must stay, or the
+    # dependent would lose the dependency and run early.
+    return (
+        Task.objects.filter(status__in=FINAL_STATUSES, created_at__lt=cutoff)
+        .exclude(dependent_tasks__status__in=ACTIVE_STATUSES)
+        .order_by()
+    )
+
+
+def archive_tasks(retention_days=None, chunk_size=None, dry_run=False):
+    retention_days = settings.TASK_ARCHIVE_RETENTION_DAYS if retention_days is None else retention_days
+    chunk_size = chunk_size or settings.TASK_ARCHIVE_CHUNK_SIZE
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    if dry_run:
+        return archivable_tasks(cutoff).count()
+
+    archived = 0
+    while True:
+        # One short transaction per chunk keeps the write lock away from the workers.
+        with transaction.atomic():
+            rows = list(
+                archivable_tasks(cutoff).values(
+                    'id', 'name', 'queue', 'status', 'arguments', 'created_at', 'completed_at', 'attempts', 'last_errors'
+                )[:chunk_size]
+            )
+            if not rows:
+                break
+
+            TaskArchive.objects.bulk_create([
+                TaskArchive(
+                    task_id=row['id'],
+                    name=row['name'],
+                    queue=row['queue'],
+                    status=row['status'],
+                    arguments=row['arguments'],
+                    created_at=row['created_at'],
+                    completed_at=row['completed_at'],
+                    attempts=row['attempts'],
+                    last_error=row['last_errors'][-1] if row['last_errors'] else None,
+                )
+                for row in rows
+            ], ignore_conflicts=True)
+            Task.objects.filter(id__in=[row['id'] for row in rows]).delete()
+
+        archived += len(rows)
+        logger.info("Archived %s tasks (%s so far)", len(rows), archived)
+
+    logger.info("Task archival finished: %s tasks older than %s archived", archived, cutoff)
+    return archived
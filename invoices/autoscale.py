@@ -0,0 +1,262 @@
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Count, Q
+from django.utils import timezone
+from django_async_manager.models import Task
+from django_async_manager.worker import TaskWorker
+
+from invoices import metrics
+
+logger = logging.getLogger('django_async_manager.worker')
+
+
+def ready_tasks(queues):
+    """Pending tasks a worker could pick up now: due, with all dependencies completed."""
+    return (
+        Task.objects.filter(status='pending', queue__in=queues)
+        .filter(Q(scheduled_at__isnull=True) | Q(scheduled_at__lte=timezone.now()))
+        .exclude(dependencies__in=Task.objects.exclude(status='completed'))
+    )
+
+
+def threads_fork_safely():
+    """Whether a worker thread may fork its task process.
+
+    SQLite connections do not survive a fork from a process where other threads
+    are using SQLite, so there every pool runs worker processes.
+    """
+    return connection.vendor != 'sqlite'
+
+
+class StoppableTaskWorker(TaskWorker):
+    """A TaskWorker whose loop ends, after its current task, once ``stop_event`` is set."""
+
+    def __init__(self, worker_id, queue, stop_event, poll_interval, use_threads=True):
+        super().__init__(worker_id, queue=queue, use_threads=use_threads)
+        self.stop_event = stop_event
+        self.poll_interval = poll_interval
+
+    def run(self):
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    self.process_task()
+                    # Go straight on to the next task while the queue has work.
+                    idle = not ready_tasks([self.queue]).exists()
+                except Exception:
+                    logger.exception("Worker %s encountered an error in process_task", self.worker_id)
+                    idle = True
+                if idle:
+                    self.stop_event.wait(self.poll_interval)
+        finally:
+            connection.close()
+
+
+class AdaptivePool:
+    """Workers for one queue whose number and kind can change while it runs.
+
+    Every task runs in a child process forked by its worker (the library's
+    execute_task), so the worker count is the queue's task concurrency either
+    way. Thread workers are cheap and suit tasks that mostly wait; process
+    workers fork tasks from a single-threaded parent, which keeps CPU-heavy
+    tasks from sharing a parent with many busy threads and is the only safe
+    way to fork SQLite users.
+    """
+
+    def __init__(self, queue, poll_interval):
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self._workers = []  # (thread or process, stop event, is a process)
+        self._started = 0
+
+    def _running(self):
+        self._workers = [worker for worker in self._workers if worker[0].is_alive()]
+        return [worker for worker in self._workers if not worker[1].is_set()]
+
+    @property
+    def size(self):
+        return len(self._running())
+
+    @property
+    def processes(self):
+        running = self._running()
+        return bool(running) and running[0][2]
+
+    def _start(self, processes):
+        self._started += 1
+        worker_id = f'{self.queue}-{self._started}'
+        if processes:
+            stop = multiprocessing.Event()
+            worker = StoppableTaskWorker(worker_id, self.queue, stop, self.poll_interval, use_threads=False)
+            # The child must not reuse this process's database connection.
+            connections.close_all()
+            # Not a daemon: daemonic processes may not fork the task processes.
+            handle = multiprocessing.Process(target=worker.run, name=worker_id)
+        else:
+            stop = threading.Event()
+            worker = StoppableTaskWorker(worker_id, self.queue, stop, self.poll_interval)
+            handle = threading.Thread(target=worker.run, name=worker_id, daemon=True)
+        handle.start()
+        self._workers.append((handle, stop, processes))
+
+    def resize(self, target, processes=False):
+        # Workers stop after their current task: the newest first, and those of
+        # the other kind when the queue switches between threads and processes.
+        running = self._running()
+        for _, stop, is_process in running:
+            if is_process != processes:
+                stop.set()
+        for _, stop, _ in [worker for worker in running if worker[2] == processes][target:]:
+            stop.set()
+        while self.size < target:
+            self._start(processes)
+
+    def stop(self, timeout=None):
+        for _, stop, _ in self._workers:
+            stop.set()
+        for handle, _, _ in self._workers:
+            handle.join(timeout)
+
+
+def task_cost_ratios(snapshot):
+    """CPU seconds per wall second of each task, from the recorded task metrics."""
+    ratios = {}
+    for task, cpu in snapshot['cpu_seconds'].items():
+        wall = snapshot['histograms'].get(f'{task}|total', {}).get('sum', 0)
+        if wall > 0:
+            ratios[task] = min(cpu / wall, 1.0)
+    return ratios
+
+
+def queue_cost_ratios(ratios, snapshot, window):
+    """Weigh the task ratios by the task mix each queue completed within ``window``."""
+    mix = (
+        Task.objects.filter(status='completed', completed_at__gte=timezone.now() - window)
+        .values('queue', 'name').annotate(n=Count('id'))
+    )
+    cpu, wall = {}, {}
+    for row in mix:
+        task = row['name']
+        histogram = snapshot['histograms'].get(f'{task}|total')
+        if task not in ratios or not histogram or not histogram['count']:
+            continue
+        mean_wall = histogram['sum'] / histogram['count']
+        cpu[row['queue']] = cpu.get(row['queue'], 0) + row['n'] * mean_wall * ratios[task]
+        wall[row['queue']] = wall.get(row['queue'], 0) + row['n'] * mean_wall
+    return {queue: cpu[queue] / wall[queue] for queue in wall if wall[queue] > 0}
+
+
+def worker_limit(cpu_ratio, min_workers, max_workers, cpu_count, cpu_bound_ratio):
+    if cpu_ratio is None:
+        limit = max_workers
+    elif cpu_ratio >= cpu_bound_ratio:
+        # CPU-bound: more tasks than cores only adds context switching.
+        limit = cpu_count
+    else:
+        # I/O-bound: a task keeps a core busy for cpu_ratio of its time.
+        limit = math.ceil(cpu_count / max(cpu_ratio, 0.01))
+    return max(min_workers, min(limit, max_workers))
+
+
+def target_workers(current, pending, limit, min_workers):
+    """Grow straight to the backlog (up to ``limit``), shrink one worker per decision."""
+    wanted = max(min_workers, min(pending, limit))
+    if wanted < current:
+        return max(wanted, current - 1)
+    return wanted
+
+
+class Autoscaler:
+    """Resize an AdaptivePool per queue from its backlog and recorded task cost.
+
+    Each decision reads the task metrics (CPU and wall time per task name), weighs
+    them by the tasks each queue completed recently and publishes the outcome as
+    ``invoice_queue_*`` gauges next to the task metrics.
+    """
+
+    pool_class = AdaptivePool
+
+    def __init__(self, queues, topology, options=None):
+        options = {**settings.TASK_AUTOSCALE, **(options or {})}
+        self.interval = options['interval']
+        self.window = timedelta(seconds=options['profile_window'])
+        self.cpu_bound_ratio = options['cpu_bound_ratio']
+        try:
+            self.cpu_count = len(os.sched_getaffinity(0))
+        except AttributeError:  # pragma: no cover - not Linux
+            self.cpu_count = os.cpu_count() or 1
+        self.limits = {
+            queue: (
+                topology[queue].get('min_workers', options['min_workers']),
+                topology[queue].get('max_workers', options['max_workers']),
+            )
+            for queue in queues
+        }
+        # Until a queue has a cost profile, its `processes` setting picks the worker kind.
+        self.configured_processes = {queue: topology[queue].get('processes', False) for queue in queues}
+        self.threads_fork_safely = threads_fork_safely()
+        self.pools = {queue: self.pool_class(queue, options['poll_interval']) for queue in queues}
+        for queue, pool in self.pools.items():
+            min_workers, max_workers = self.limits[queue]
+            pool.resize(
+                max(min_workers, min(topology[queue].get('workers', 1), max_workers)),
+                self.use_processes(queue, None),
+            )
+
+    def use_processes(self, queue, cpu_ratio):
+        if not self.threads_fork_safely:
+            return True
+        if cpu_ratio is None:
+            return self.configured_processes[queue]
+        return cpu_ratio >= self.cpu_bound_ratio
+
+    def step(self):
+        snapshot = metrics.load()
+        ratios = task_cost_ratios(snapshot)
+        queue_ratios = queue_cost_ratios(ratios, snapshot, self.window)
+        pending = dict(ready_tasks(list(self.pools)).values_list('queue').annotate(n=Count('id')))
+
+        decisions = {}
+        for queue, pool in self.pools.items():
+            min_workers, max_workers = self.limits[queue]
+            cpu_ratio = queue_ratios.get(queue)
+            limit = worker_limit(cpu_ratio, min_workers, max_workers, self.cpu_count, self.cpu_bound_ratio)
+            processes = self.use_processes(queue, cpu_ratio)
+            current = pool.size
+            target = target_workers(current, pending.get(queue, 0), limit, min_workers)
+            if target != current or (current and processes != pool.processes):
+                logger.info(
+                    "Queue '%s': %s -> %s %s (pending %s, cpu ratio %s, limit %s)",
+                    queue, current, target, 'processes' if processes else 'threads', pending.get(queue, 0),
+                    'unknown' if cpu_ratio is None else f'{cpu_ratio:.2f}', limit,
+                )
+                pool.resize(target, processes)
+            decisions[queue] = target
+
+            metrics.set_gauge('invoice_queue_workers', queue, target)
+            metrics.set_gauge('invoice_queue_worker_processes', queue, int(processes))
+            metrics.set_gauge('invoice_queue_worker_limit', queue, limit)
+            metrics.set_gauge('invoice_queue_pending_tasks', queue, pending.get(queue, 0))
+            if cpu_ratio is not None:
+                metrics.set_gauge('invoice_queue_cpu_ratio', queue, round(cpu_ratio, 4))
+        for task, ratio in ratios.items():
+            metrics.set_gauge('invoice_task_cpu_ratio', task, round(ratio, 4))
+        metrics.flush()
+        return decisions
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                self.step()
+            except Exception:
+                logger.exception("Autoscaler decision failed; keeping the current pool sizes")
+            stop_event.wait(self.interval)
+        for pool in self.pools.values():
+            pool.stop()
@@ -0,0 +1,164 @@
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+import uuid
+from decimal import Decimal
+
+import django
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from invoices import tasks
+from invoices.models import Customer, Invoice, InvoiceItem
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def customer_name_prefix(run_id):
+    return f'Bench Customer {run_id}-'
+
+
+def seed(customers=20, invoices_per_customer=5, items_per_invoice=3, random_seed=0, run_id='0'):
+    # run_id keeps invoice numbers unique when several runs share a database.
+    rng = random.Random(random_seed)
+    customer_objs = Customer.objects.bulk_create([
+        Customer(name=f'{customer_name_prefix(run_id)}{i}', email=f'bench{i}@example.com', address=f'{i} Bench Street')
+        for i in range(customers)
+    ])
+
+    invoice_objs = []
+    items_per_invoice_objs = []
+    for customer in customer_objs:
+        for _ in range(invoices_per_customer):
+            items = [
+                InvoiceItem(
+                    description=f'Item {n}',
+                    quantity=rng.randint(1, 5),
+                    unit_price=Decimal(rng.randint(100, 50000)) / 100,
+                )
+                for n in range(items_per_invoice)
+            ]
+            invoice_objs.append(Invoice(
+                invoice_number=f'BENCH-{run_id}-{len(invoice_objs):08d}',
+                customer=customer,
+                due_date=timezone.now().date(),
+                total_amount=sum(item.quantity * item.unit_price for item in items),
+            ))
+            items_per_invoice_objs.append(items)
+
+    Invoice.objects.bulk_create(invoice_objs)
+    for invoice, items in zip(invoice_objs, items_per_invoice_objs):
+        for item in items:
+            item.invoice = invoice
+    InvoiceItem.objects.bulk_create([item for items in items_per_invoice_objs for item in items])
+    return customer_objs, invoice_objs
+
+
+def measure(func, iterations):
+    latencies = []
+    queries = 0
+    started = time.perf_counter()
+    for i in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            op_started = time.perf_counter()
+            func(i)
+            latencies.append(time.perf_counter() - op_started)
+        queries += len(captured)
+    elapsed = time.perf_counter() - started
+    return {
+        'iterations': iterations,
+        'ops_per_s': round(iterations / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'queries_per_op': round(queries / iterations, 2) if iterations else 0.0,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(customers=20, invoices_per_customer=5, items_per_invoice=3, iterations=20, report_iterations=3):
+    run_id = uuid.uuid4().hex[:8]
+    try:
+        return _run_benchmarks(run_id, customers, invoices_per_customer, items_per_invoice, iterations, report_iterations)
+    finally:
+        # With --use-existing-db the seeded rows, and the invoices the cases created
+        # for them, must not outlive the run; deleting the customers cascades.
+        Customer.objects.filter(name__startswith=customer_name_prefix(run_id)).delete()
+
+
+def _run_benchmarks(run_id, customers, invoices_per_customer, items_per_invoice, iterations, report_iterations):
+    customer_objs, invoice_objs = seed(customers, invoices_per_customer, items_per_invoice, run_id=run_id)
+    client = Client()
+
+    def invoice(i):
+        return invoice_objs[i % len(invoice_objs)]
+
+    def send_chain(i):
+        invoice_id = invoice(i).id
+        tasks.validate_invoice_data.__wrapped__(invoice_id)
+        tasks.generate_invoice_pdf.__wrapped__(invoice_id)
+        tasks.log_email_activity.__wrapped__(invoice_id)
+        tasks.update_customer_communication_history.__wrapped__(invoice_id)
+        tasks.send_invoice_email.__wrapped__(invoice_id)
+
+    cases = {
+        'generate_invoice': (lambda i: tasks.generate_invoice.__wrapped__(customer_objs[i % len(customer_objs)].id), iterations),
+        'generate_invoice_pdf': (lambda i: tasks.generate_invoice_pdf.__wrapped__(invoice(i).id), iterations),
+        'send_invoice_email_chain': (send_chain, iterations),
+        'generate_daily_invoice_report': (lambda i: tasks.generate_daily_invoice_report.__wrapped__(), report_iterations),
+        'view_index': (lambda i: client.get(reverse('index')), iterations),
+        'view_invoice_list': (lambda i: client.get(reverse('invoice_list')), iterations),
+        'view_invoice_detail': (lambda i: client.get(reverse('invoice_detail', args=[invoice(i).id])), iterations),
+        'view_customer_list': (lambda i: client.get(reverse('customer_list')), iterations),
+        'view_customer_detail': (lambda i: client.get(reverse('customer_detail', args=[customer_objs[i % len(customer_objs)].id])), iterations),
+    }
+
+    # Generated files, metrics and mail stay out of the project tree and off the network.
+    with tempfile.TemporaryDirectory(prefix='invoice_bench_') as workdir, override_settings(
+        BASE_DIR=workdir,
+        STORAGES={
+            **settings.STORAGES,
+            'invoice_files': {
+                'BACKEND': 'invoices.storage.ShardedFileSystemStorage',
+                'OPTIONS': {'location': workdir},
+            },
+        },
+        EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+        TASK_METRICS_FILE=os.path.join(workdir, 'task_metrics.json'),
+        ALLOWED_HOSTS=['testserver'],
+    ):
+        results = {name: measure(func, count) for name, (func, count) in cases.items()}
+
+    return {
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'volume': {
+            'customers': customers,
+            'invoices': len(invoice_objs),
+            'items_per_invoice': items_per_invoice,
+        },
+        'results': results,
+    }
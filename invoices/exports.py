@@ -0,0 +1,146 @@
+import csv
+import json
+import zlib
+from itertools import groupby
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from invoices.models import Invoice
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+INVOICE_FIELDS = ('id', 'invoice_number', 'issue_date', 'due_date', 'status', 'total_amount', 'created_at')
+CUSTOMER_FIELDS = ('customer_id', 'customer__name', 'customer__email')
+ITEM_FIELDS = ('items__description', 'items__quantity', 'items__unit_price')
+
+CSV_HEADER = (
+    'invoice_id', 'invoice_number', 'issue_date', 'due_date', 'status', 'total_amount', 'created_at',
+    'customer_id', 'customer_name', 'customer_email',
+    'item_description', 'item_quantity', 'item_unit_price', 'item_total',
+)
+
+# Flush output in pieces about this big rather than one tiny write per row.
+WRITE_SIZE = 64 * 1024
+
+
+def filter_invoices(date_from=None, date_to=None, statuses=None, customer_id=None):
+    invoices = Invoice.objects.all()
+    if date_from:
+        invoices = invoices.filter(issue_date__gte=date_from)
+    if date_to:
+        invoices = invoices.filter(issue_date__lte=date_to)
+    if statuses:
+        invoices = invoices.filter(status__in=statuses)
+    if customer_id:
+        invoices = invoices.filter(customer_id=customer_id)
+    return invoices
+
+
+def iter_invoice_rows(invoices, page_size=None):
+    """Yield one ``values()`` row per invoice item (one with empty item fields for
+    an invoice without items), ordered by invoice.
+
+    Pages are selected by keyset on the invoice id, so each query is short and no
+    read transaction stays open for the whole export (which on SQLite would keep
+    the WAL from being checkpointed).
+    """
+    page_size = page_size or settings.INVOICE_EXPORT_PAGE_SIZE
+    last_id = 0
+    while True:
+        ids = list(
+            invoices.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:page_size]
+        )
+        if not ids:
+            return
+        # A range rather than id__in keeps the query small whatever the page size.
+        rows = (
+            invoices.filter(id__gt=last_id, id__lte=ids[-1])
+            .order_by('id', 'items__id')
+            .values(*INVOICE_FIELDS, *CUSTOMER_FIELDS, *ITEM_FIELDS)
+        )
+        yield from rows.iterator(chunk_size=page_size)
+        last_id = ids[-1]
+
+
+def _csv_lines(rows):
+    class Echo:
+        def write(self, value):
+            return value
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        has_item = row['items__description'] is not None
+        yield writer.writerow((
+            row['id'], row['invoice_number'], row['issue_date'], row['due_date'], row['status'],
+            row['total_amount'], row['created_at'].isoformat(),
+            row['customer_id'], row['customer__name'], row['customer__email'],
+            row['items__description'] if has_item else '',
+            row['items__quantity'] if has_item else '',
+            row['items__unit_price'] if has_item else '',
+            row['items__quantity'] * row['items__unit_price'] if has_item else '',
+        ))
+
+
+def _ndjson_lines(rows):
+    # One line per invoice with its items nested; rows arrive grouped by invoice.
+    for _, invoice_rows in groupby(rows, key=lambda row: row['id']):
+        invoice_rows = list(invoice_rows)
+        first = invoice_rows[0]
+        record = {
+            'invoice_id': first['id'],
+            'invoice_number': first['invoice_number'],
+            'issue_date': first['issue_date'],
+            'due_date': first['due_date'],
+            'status': first['status'],
+            'total_amount': first['total_amount'],
+            'created_at': first['created_at'],
+            'customer': {
+                'id': first['customer_id'],
+                'name': first['customer__name'],
+                'email': first['customer__email'],
+            },
+            'items': [
+                {
+                    'description': row['items__description'],
+                    'quantity': row['items__quantity'],
+                    'unit_price': row['items__unit_price'],
+                }
+                for row in invoice_rows if row['items__description'] is not None
+            ],
+        }
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
+
+
+def export_chunks(invoices, fmt='csv', compress=False, page_size=None):
+    """Yield the export as byte chunks, gzip-compressed on the fly when asked."""
+    lines = {'csv': _csv_lines, 'ndjson': _ndjson_lines}[fmt](iter_invoice_rows(invoices, page_size))
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+
+    buffer, size = [], 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= WRITE_SIZE:
+            data = ''.join(buffer).encode()
+            buffer, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = ''.join(buffer).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def export_filename(fmt, compress=False, today=None):
+    today = today or timezone.now().date()
+    return f"invoices-{today:%Y%m%d}.{fmt}{'.gz' if compress else ''}"
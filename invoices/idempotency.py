@@ -0,0 +1,33 @@
+import logging
+
+from django.db import IntegrityError, transaction
+
+from invoices.models import TaskIdempotencyKey
+
+logger = logging.getLogger('task_worker')
+
+# A key blocks new enqueues only while its task is in one of these states; once
+# the task has finished (completed, failed or canceled) the key can be reused.
+ACTIVE_STATUSES = ('pending', 'in_progress')
+
+
+# Returns (task, created); a duplicate submission gets the existing task back.
+def enqueue_once(key, task_func, *args, **kwargs):
+    existing = TaskIdempotencyKey.objects.select_related('task').filter(key=key).first()
+    if existing and existing.task.status in ACTIVE_STATUSES:
+        logger.info("Duplicate enqueue for key %s, reusing task %s", key, existing.task_id)
+        return existing.task, False
+
+    try:
+        with transaction.atomic():
+            if existing:
+                TaskIdempotencyKey.objects.filter(pk=existing.pk, task_id=existing.task_id).delete()
+            task = task_func(*args, **kwargs)
+            TaskIdempotencyKey.objects.create(key=key, task=task)
+    except IntegrityError:
+        # Another request claimed the key first; its tasks are committed, ours were rolled back.
+        winner = TaskIdempotencyKey.objects.select_related('task').get(key=key)
+        logger.info("Lost enqueue race for key %s, reusing task %s", key, winner.task_id)
+        return winner.task, False
+
+    return task, True
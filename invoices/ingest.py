@@ -0,0 +1,240 @@
+import codecs
+import json
+import logging
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import transaction
+from django_async_manager.models import Task
+
+from invoices.models import Customer, InvoiceBatch, InvoiceItem
+from invoices.tasks import complete_invoice_batch, generate_invoices_bulk
+
+logger = logging.getLogger('task_worker')
+
+READ_SIZE = 64 * 1024
+# Only the first rejections are kept on the batch; the rest are just counted.
+MAX_STORED_ERRORS = 100
+# Chunk tasks wait as 'canceled' until the whole body has parsed, so workers
+# skip them and a truncated upload creates nothing. Should the ingest die
+# mid-stream, they are archived like any other finished task.
+HELD_STATUS = 'canceled'
+HELD_UPDATE_SIZE = 500
+
+_decoder = json.JSONDecoder()
+
+
+class MalformedPayload(ValueError):
+    pass
+
+
+def iter_json_rows(stream, read_size=READ_SIZE, max_row_bytes=None):
+    """Yield the objects of a JSON array or an NDJSON body, reading ``stream`` incrementally.
+
+    At most one row plus one read is held in memory, whatever the body size.
+    """
+    max_row_bytes = max_row_bytes or settings.BULK_INGEST_MAX_ROW_BYTES
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer, pos, eof = '', 0, False
+    in_array, closed = None, False
+
+    while True:
+        # Skip whitespace and, inside a JSON array, the separators around rows.
+        while pos < len(buffer) and (buffer[pos].isspace() or (in_array and not closed and buffer[pos] == ',')):
+            pos += 1
+        if pos < len(buffer) and in_array is None:
+            in_array = buffer[pos] == '['
+            if in_array:
+                pos += 1
+                continue
+        if closed and pos < len(buffer):
+            raise MalformedPayload('Unexpected data after the closing bracket')
+        if in_array and pos < len(buffer) and buffer[pos] == ']':
+            closed = True
+            pos += 1
+            continue
+
+        if pos < len(buffer):
+            try:
+                row, end = _decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                # Usually just a row cut off by the read boundary; read more unless
+                # the input is exhausted or the row is already too large.
+                if eof:
+                    raise MalformedPayload(f'Invalid JSON: {exc.msg}') from None
+                if len(buffer) - pos > max_row_bytes:
+                    raise MalformedPayload(f'Invalid JSON or row larger than {max_row_bytes} bytes') from None
+            else:
+                # A bare number or literal ending the buffer may continue in the next read.
+                if end < len(buffer) or eof:
+                    pos = end
+                    yield row
+                    continue
+        elif eof:
+            if in_array and not closed:
+                raise MalformedPayload('Missing closing bracket')
+            return
+
+        data = stream.read(read_size)
+        eof = not data
+        try:
+            buffer = buffer[pos:] + decoder.decode(data or b'', final=eof)
+        except UnicodeDecodeError:
+            raise MalformedPayload('Body is not valid UTF-8') from None
+        pos = 0
+
+
+def clean_row(row):
+    """Return ``(customer_id, items, due_days)`` for a valid row or raise ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError('Row must be a JSON object')
+
+    customer_id = row.get('customer_id')
+    if not isinstance(customer_id, int) or isinstance(customer_id, bool):
+        raise ValueError('customer_id must be an integer')
+
+    due_days = row.get('due_days', 30)
+    if not isinstance(due_days, int) or isinstance(due_days, bool) or not 0 <= due_days <= 3650:
+        raise ValueError('due_days must be an integer between 0 and 3650')
+
+    items = row.get('items')
+    if not isinstance(items, list) or not items:
+        raise ValueError('items must be a non-empty list')
+
+    description_length = InvoiceItem._meta.get_field('description').max_length
+    cleaned = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('Each item must be a JSON object')
+        description = item.get('description')
+        if not isinstance(description, str) or not description.strip() or len(description) > description_length:
+            raise ValueError(f'Item description must be 1-{description_length} characters')
+        quantity = item.get('quantity', 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+            raise ValueError('Item quantity must be a positive integer')
+        try:
+            unit_price = Decimal(str(item.get('unit_price')))
+        except InvalidOperation:
+            raise ValueError('Item unit_price must be a number') from None
+        if not unit_price.is_finite() or unit_price < 0 or unit_price != unit_price.quantize(Decimal('0.01')):
+            raise ValueError('Item unit_price must be a non-negative amount with at most 2 decimals')
+        # Prices travel to the task as strings so they survive JSON unchanged.
+        cleaned.append({'description': description, 'quantity': quantity, 'unit_price': str(unit_price)})
+
+    return customer_id, cleaned, due_days
+
+
+class BatchIngest:
+    """Validate streamed rows and stage one ``generate_invoices_bulk`` task per chunk.
+
+    The staged tasks are released once the body has parsed cleanly and dropped
+    if it turns out to be malformed or cannot be read to the end.
+    """
+
+    def __init__(self, batch, chunk_size=None):
+        self.batch = batch
+        self.chunk_size = chunk_size or settings.BULK_INGEST_CHUNK_SIZE
+        self.pending = []
+        self.rows = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.errors = []
+        self.held = []
+
+    def reject(self, row_index, message):
+        self.rejected += 1
+        if len(self.errors) < MAX_STORED_ERRORS:
+            self.errors.append({'row': row_index, 'error': message})
+
+    def add(self, row):
+        row_index = self.rows
+        self.rows += 1
+        try:
+            customer_id, items, due_days = clean_row(row)
+        except ValueError as exc:
+            self.reject(row_index, str(exc))
+            return
+        self.pending.append([row_index, customer_id, items, due_days])
+        if len(self.pending) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        # One query per chunk checks every customer the chunk refers to.
+        known = set(Customer.objects.filter(
+            id__in={customer_id for _, customer_id, _, _ in self.pending}
+        ).values_list('id', flat=True))
+        rows = []
+        for entry in self.pending:
+            if entry[1] in known:
+                rows.append(entry)
+            else:
+                self.reject(entry[0], f'Customer {entry[1]} does not exist')
+        self.pending = []
+
+        if rows:
+            # Held in the same transaction, so no worker sees the task pending.
+            with transaction.atomic():
+                task = generate_invoices_bulk(str(self.batch.id), self.chunks, rows)
+                Task.objects.filter(pk=task.pk).update(status=HELD_STATUS)
+            self.held.append(task.pk)
+            self.chunks += 1
+        self.save_progress()
+
+    def held_tasks(self):
+        for start in range(0, len(self.held), HELD_UPDATE_SIZE):
+            yield Task.objects.filter(id__in=self.held[start:start + HELD_UPDATE_SIZE])
+
+    def save_progress(self, **fields):
+        InvoiceBatch.objects.filter(pk=self.batch.pk).update(
+            rows_received=self.rows,
+            rows_rejected=self.rejected,
+            chunks_total=self.chunks,
+            errors=self.errors,
+            **fields,
+        )
+
+    def abort(self, exc):
+        for tasks in self.held_tasks():
+            tasks.delete()
+        self.held, self.pending, self.chunks = [], [], 0
+        error = str(exc) if isinstance(exc, MalformedPayload) else f'{type(exc).__name__}: {exc}'
+        self.errors.append({'row': self.rows, 'error': error})
+        self.save_progress(status='failed')
+        logger.warning("Bulk ingest %s stopped at row %s: %s", self.batch.id, self.rows, error)
+
+    def run(self, stream):
+        # Whatever ends the stream early (a malformed body, a client disconnect,
+        # a database error) drops the held tasks and fails the batch.
+        try:
+            for row in iter_json_rows(stream):
+                self.add(row)
+            self.flush()
+        except BaseException as exc:
+            self.abort(exc)
+            raise
+
+        # The chunk tasks only run for a batch that is processing.
+        self.save_progress(status='processing')
+        for tasks in self.held_tasks():
+            tasks.update(status='pending')
+        complete_invoice_batch(self.batch.pk)
+        logger.info(
+            "Bulk ingest %s received %s rows (%s rejected) in %s chunks",
+            self.batch.id, self.rows, self.rejected, self.chunks,
+        )
+
+
+
+def batch_progress(batch):
+    return {
+        'batch_id': str(batch.id),
+        'status': batch.status,
+        'rows_received': batch.rows_received,
+        'rows_rejected': batch.rows_rejected,
+        'chunks_total': batch.chunks_total,
+        'chunks_done': batch.chunks_done,
+        'invoices_created': batch.invoices_created,
+        'errors': batch.errors,
+    }
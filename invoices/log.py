@@ -0,0 +1,132 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import multiprocessing
+import os
+import queue
+import sys
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+
+_context = contextvars.ContextVar('log_context', default={})
+
+# Attributes every LogRecord has; anything else was passed via extra= or bind().
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+@contextmanager
+def bind(**fields):
+    """Attach ``fields`` to every record logged in this context (e.g. invoice_id)."""
+    token = _context.set({**_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        entry.update({
+            key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRS and not key.startswith('_')
+        })
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class _Pipe:
+    """multiprocessing.SimpleQueue with the queue.Queue methods QueueHandler and QueueListener call.
+
+    A multiprocessing.Queue starts a feeder thread on its first put, which at
+    interpreter shutdown (the listener's stop sentinel) raises RuntimeError.
+    """
+
+    def __init__(self):
+        self._queue = multiprocessing.SimpleQueue()
+
+    def put_nowait(self, item):
+        self._queue.put(item)
+
+    def get(self, block=True):
+        return self._queue.get()
+
+
+class AsyncHandler(logging.handlers.QueueHandler):
+    """Hand records to a background thread that formats and writes them.
+
+    The calling thread only copies the bound context onto the record and puts
+    it on an in-memory queue; message formatting and file/console I/O happen
+    in a QueueListener thread.
+
+    Only the process that created the handler writes the file. Forked children
+    (task processes, process workers) send their records to its listener over a
+    pipe: a child rotating the file itself would rename it under the parent.
+    """
+
+    def __init__(self, filename, json_format=True, console=True, max_bytes=50 * 1024 * 1024, backup_count=5):
+        super().__init__(queue.SimpleQueue())
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+        file_handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=max_bytes, backupCount=backup_count, delay=True
+        )
+        if json_format:
+            file_handler.setFormatter(JsonFormatter())
+        else:
+            file_handler.setFormatter(logging.Formatter('{asctime} - {levelname} - {name} - {message}', style='{'))
+        self.targets = [file_handler]
+
+        if console:
+            console_handler = logging.StreamHandler(sys.stderr)
+            console_handler.setFormatter(logging.Formatter('{levelname} - {message}', style='{'))
+            self.targets.append(console_handler)
+
+        self.child_queue = _Pipe()
+        self.listeners = [
+            logging.handlers.QueueListener(records, *self.targets, respect_handler_level=True)
+            for records in (self.child_queue, self.queue)
+        ]
+        for listener in self.listeners:
+            listener.start()
+        atexit.register(self._stop_listeners)
+        os.register_at_fork(after_in_child=self._forward_in_child)
+
+    def _stop_listeners(self):
+        # Child records first: they were logged before the sentinel reaches the
+        # pipe. The exit stack runs its callbacks last in, first out, and runs
+        # every one even when an earlier one raises.
+        with ExitStack() as stack:
+            for listener in reversed(self.listeners):
+                if listener._thread is not None:
+                    stack.callback(listener.stop)
+
+    def _forward_in_child(self):
+        # The inherited listeners are the parent's; stopping them here would
+        # send the parent's child listener a sentinel.
+        self.queue = self.child_queue
+        self.listeners = []
+
+    def prepare(self, record):
+        for key, value in _context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        if self.queue is not self.child_queue:
+            # Records are passed by reference, so nothing is formatted here.
+            return record
+        # Crossing the pipe means pickling: render the message and traceback
+        # now, and turn extra fields the parent could not unpickle into text.
+        record = super().prepare(record)
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not isinstance(value, (str, int, float, bool, type(None))):
+                setattr(record, key, str(value))
+        return record
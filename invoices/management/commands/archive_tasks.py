@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from invoices.archival import archive_tasks
+
+
+class Command(BaseCommand):
+    help = 'Move finished tasks older than the retention window into the task archive table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days',
+            type=int,
+            default=None,
+            help='Archive tasks older than this many days (default: TASK_ARCHIVE_RETENTION_DAYS).',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=None,
+            help='Tasks moved per transaction (default: TASK_ARCHIVE_CHUNK_SIZE).',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report how many tasks would be archived.',
+        )
+
+    def handle(self, *args, **options):
+        count = archive_tasks(
+            retention_days=options['retention_days'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+        )
+        if options['dry_run']:
+            self.stdout.write(f'{count} tasks would be archived.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Archived {count} tasks.'))
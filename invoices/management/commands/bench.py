@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from invoices.bench import run_benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the invoice tasks and views and report ops/sec, p50/p99 and query counts as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=20, help='Customers to seed (default: 20)')
+        parser.add_argument('--invoices-per-customer', type=int, default=5, help='Invoices per customer (default: 5)')
+        parser.add_argument('--items-per-invoice', type=int, default=3, help='Items per invoice (default: 3)')
+        parser.add_argument('--iterations', type=int, default=20, help='Iterations per case (default: 20)')
+        parser.add_argument(
+            '--report-iterations',
+            type=int,
+            default=3,
+            help='Iterations of the daily report, which covers every seeded invoice (default: 3)',
+        )
+        parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file.')
+        parser.add_argument(
+            '--use-existing-db',
+            action='store_true',
+            help='Seed and measure against the configured database instead of a throwaway test database.',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = None
+        if not options['use_existing_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            report = run_benchmarks(
+                customers=options['customers'],
+                invoices_per_customer=options['invoices_per_customer'],
+                items_per_invoice=options['items_per_invoice'],
+                iterations=options['iterations'],
+                report_iterations=options['report_iterations'],
+            )
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote benchmark report to {options['output']}"))
+        else:
+            self.stdout.write(output)
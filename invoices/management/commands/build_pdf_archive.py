@@ -0,0 +1,48 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from invoices.tasks import build_invoice_pdf_archive
+
+
+class Command(BaseCommand):
+    help = 'Build a ZIP of invoice PDFs (with a manifest) for a filtered set of invoices'
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', help='Archive name, written to invoice_archives/<name>.zip')
+        parser.add_argument('--date-from', type=str, default=None, help='Only invoices issued on or after this date.')
+        parser.add_argument('--date-to', type=str, default=None, help='Only invoices issued on or before this date.')
+        parser.add_argument(
+            '--status',
+            type=str,
+            default='',
+            help='Comma-separated invoice statuses to include (default: all).',
+        )
+        parser.add_argument('--customer', type=int, default=None, help='Only invoices of this customer id.')
+        parser.add_argument(
+            '--now',
+            action='store_true',
+            help='Build the archive in this process instead of enqueueing a task on the render queue.',
+        )
+
+    def handle(self, *args, **options):
+        if not re.fullmatch(r'[\w.-]+', options['name']):
+            raise CommandError('Archive names may only contain letters, digits, ".", "_" and "-".')
+        for option in ('date_from', 'date_to'):
+            if options[option] and parse_date(options[option]) is None:
+                raise CommandError(f"--{option.replace('_', '-')} must be a YYYY-MM-DD date")
+
+        arguments = dict(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            statuses=[status for status in options['status'].split(',') if status] or None,
+            customer_id=options['customer'],
+        )
+        if options['now']:
+            path = build_invoice_pdf_archive.__wrapped__(options['name'], **arguments)
+            self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
+            return
+
+        task = build_invoice_pdf_archive(options['name'], **arguments)
+        self.stdout.write(self.style.SUCCESS(f'Queued PDF archive {options["name"]} (Task ID: {task.id})'))
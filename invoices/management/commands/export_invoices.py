@@ -0,0 +1,67 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from invoices.exports import FORMATS, export_chunks, filter_invoices
+
+
+def _date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Stream invoices with their items and customer fields as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(FORMATS), default='csv', help='Output format (default: csv).')
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='-',
+            help='File to write to (default: stdout).',
+        )
+        parser.add_argument('--gzip', action='store_true', help='Compress the output with gzip.')
+        parser.add_argument('--date-from', type=_date, default=None, help='Only invoices issued on or after this date.')
+        parser.add_argument('--date-to', type=_date, default=None, help='Only invoices issued on or before this date.')
+        parser.add_argument(
+            '--status',
+            type=str,
+            default='',
+            help='Comma-separated invoice statuses to include (default: all).',
+        )
+        parser.add_argument('--customer', type=int, default=None, help='Only invoices of this customer id.')
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=None,
+            help='Invoices fetched per query (default: INVOICE_EXPORT_PAGE_SIZE).',
+        )
+
+    def handle(self, *args, **options):
+        if options['output'] == '-' and options['gzip'] and sys.stdout.isatty():
+            raise CommandError('Refusing to write gzip data to a terminal; use --output or a pipe.')
+
+        invoices = filter_invoices(
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            statuses=[status for status in options['status'].split(',') if status],
+            customer_id=options['customer'],
+        )
+        chunks = export_chunks(invoices, options['format'], options['gzip'], options['page_size'])
+
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+            return
+
+        written = 0
+        with open(options['output'], 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                written += len(chunk)
+        self.stderr.write(self.style.SUCCESS(f"Wrote {written} bytes to {options['output']}"))
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from invoices.storage import invoice_storage, migrate_flat_files
+
+
+class Command(BaseCommand):
+    help = 'Move PDFs, reports and communication histories from the old flat directories into the sharded storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source',
+            type=str,
+            default=str(settings.BASE_DIR),
+            help='Directory holding the old invoice_pdfs/ etc. directories (default: the project directory).',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Only list the files that would be moved.')
+
+    def handle(self, *args, **options):
+        moved = 0
+        for old, new in migrate_flat_files(options['source'], invoice_storage(), options['dry_run']):
+            moved += 1
+            if options['verbosity'] > 1 or options['dry_run']:
+                self.stdout.write(f'{old} -> {new}')
+        if options['dry_run']:
+            self.stdout.write(f'{moved} files would be moved.')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} files.'))
@@ -0,0 +1,87 @@
+import importlib
+import logging
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django_async_manager.worker import WorkerManager
+
+from invoices.autoscale import Autoscaler, threads_fork_safely
+
+logger = logging.getLogger('django_async_manager.worker')
+
+
+class Command(BaseCommand):
+    help = 'Launch a sized worker pool for every queue in settings.TASK_QUEUES'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queues',
+            type=str,
+            default=None,
+            help='Comma-separated subset of queues to start (default: all configured queues).',
+        )
+        parser.add_argument(
+            '--adaptive',
+            action='store_true',
+            help='Resize each pool at runtime from its backlog and task cost profile '
+                 '(settings.TASK_AUTOSCALE); `workers` is only the starting size.',
+        )
+
+    def handle(self, *args, **options):
+        topology = getattr(settings, 'TASK_QUEUES', {})
+        if not topology:
+            raise CommandError('No TASK_QUEUES found in settings.')
+
+        queues = list(topology)
+        if options['queues']:
+            queues = [queue.strip() for queue in options['queues'].split(',') if queue.strip()]
+            unknown = set(queues) - set(topology)
+            if unknown:
+                raise CommandError(f"Unknown queues: {', '.join(sorted(unknown))}")
+
+        # Register the task functions up front rather than relying on the
+        # system checks importing them through the urlconf.
+        importlib.import_module('invoices.tasks')
+        for queue in queues:
+            for module in topology[queue].get('preload', ()):
+                importlib.import_module(module)
+
+        if options['adaptive']:
+            self._run_adaptive(queues, topology)
+            return
+
+        managers = []
+        for queue in queues:
+            pool = topology[queue]
+            num_workers = pool.get('workers', 1)
+            if num_workers < 1:
+                logger.info("Skipping queue '%s' (0 workers configured)", queue)
+                continue
+
+            manager = WorkerManager(
+                num_workers=num_workers,
+                queue=queue,
+                use_threads=not pool.get('processes', False) and threads_fork_safely(),
+            )
+            manager.start_workers()
+            managers.append(manager)
+
+        if not managers:
+            raise CommandError('No worker pools were started.')
+
+        self.stdout.write(self.style.SUCCESS(f"Started worker pools for: {', '.join(m.queue for m in managers)}"))
+        for manager in managers:
+            manager.join_workers()
+
+    def _run_adaptive(self, queues, topology):
+        autoscaler = Autoscaler(queues, topology)
+        self.stdout.write(self.style.SUCCESS(f"Started adaptive worker pools for: {', '.join(queues)}"))
+        stop_event = threading.Event()
+        try:
+            autoscaler.run(stop_event)
+        except KeyboardInterrupt:
+            stop_event.set()
+            self.stdout.write('Stopping workers after their current tasks...')
+            for pool in autoscaler.pools.values():
+                pool.stop()
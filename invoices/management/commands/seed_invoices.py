@@ -0,0 +1,84 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from invoices import seeding
+from invoices.models import Invoice
+
+
+class Command(BaseCommand):
+    help = 'Generate customers, invoices, items and matching task rows for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=1000, help='Customers to create (default: 1000)')
+        parser.add_argument('--invoices', type=int, default=10000, help='Invoices to create (default: 10000)')
+        parser.add_argument('--chunk-size', type=int, default=5000, help='Invoices per bulk_create chunk (default: 5000)')
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=1,
+            help='Worker processes generating chunks in parallel (default: 1)',
+        )
+        parser.add_argument('--seed', type=int, default=42, help='Random seed; the same seed yields the same data (default: 42)')
+        parser.add_argument('--days', type=int, default=365, help='Spread issue dates over this many past days (default: 365)')
+        parser.add_argument('--prefix', type=str, default='SEED', help="Invoice number prefix (default: 'SEED')")
+        parser.add_argument(
+            '--with-tasks',
+            action='store_true',
+            help='Also create completed task rows (generate and send chains) for every invoice.',
+        )
+
+    def handle(self, *args, **options):
+        seed = options['seed']
+        prefix = options['prefix']
+        chunk_size = options['chunk_size']
+        if chunk_size < 1 or options['customers'] < 1:
+            raise CommandError('--chunk-size and --customers must be positive.')
+        if Invoice.objects.filter(invoice_number__startswith=f'{prefix}-{seed}-').exists():
+            raise CommandError(f"Invoices with prefix '{prefix}-{seed}-' already exist; use another --seed or --prefix.")
+
+        started = time.perf_counter()
+        chunks = [
+            (chunk_no, start, min(chunk_size, options['invoices'] - start), seed, prefix, options['days'], options['with_tasks'])
+            for chunk_no, start in enumerate(range(0, options['invoices'], chunk_size))
+        ]
+
+        totals = [0, 0, 0]
+        if options['processes'] > 1:
+            # Chunks commit in their own processes, so a failed run is undone by
+            # deleting what it created rather than by rolling back.
+            customer_ids = seeding.seed_customers(options['customers'], seed, chunk_size)
+            self.stdout.write(f'Created {len(customer_ids)} customers')
+            try:
+                connections.close_all()
+                with multiprocessing.Pool(
+                    options['processes'], initializer=seeding.init_worker, initargs=(customer_ids,)
+                ) as pool:
+                    results = pool.imap_unordered(seeding.seed_chunk, chunks)
+                    self._collect(results, totals, len(chunks))
+            except BaseException:
+                seeding.remove_seeded(prefix, seed, customer_ids, chunk_size)
+                raise
+        else:
+            # Customers and every chunk commit together or not at all.
+            with transaction.atomic():
+                customer_ids = seeding.seed_customers(options['customers'], seed, chunk_size)
+                self.stdout.write(f'Created {len(customer_ids)} customers')
+                seeding.init_worker(customer_ids)
+                self._collect(map(seeding.seed_chunk, chunks), totals, len(chunks))
+
+        elapsed = time.perf_counter() - started
+        invoices, items, tasks = totals
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {invoices} invoices, {items} items and {tasks} tasks in {elapsed:.1f}s '
+            f'({invoices / elapsed:.0f} invoices/s)'
+        ))
+
+    def _collect(self, results, totals, chunk_count):
+        for done, (chunk_no, invoices, items, tasks) in enumerate(results, start=1):
+            totals[0] += invoices
+            totals[1] += items
+            totals[2] += tasks
+            self.stdout.write(f'  chunk {chunk_no}: {invoices} invoices, {items} items, {tasks} tasks ({done}/{chunk_count})')
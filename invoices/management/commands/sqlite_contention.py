@@ -0,0 +1,148 @@
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, OperationalError
+from django.db.backends.signals import connection_created
+
+from invoices.bench import percentile
+from invoices.signals import configure_sqlite_connection
+
+
+def _writer(worker_no, db_path, writes, tuned, results):
+    connection = connections['default']
+    options = dict(connection.settings_dict['OPTIONS'])
+    if not tuned:
+        connection_created.disconnect(configure_sqlite_connection, dispatch_uid='invoices.sqlite_pragmas')
+        options.pop('transaction_mode', None)
+        options.pop('timeout', None)
+    connection.settings_dict = {**connection.settings_dict, 'NAME': db_path, 'OPTIONS': options}
+
+    latencies = []
+    errors = 0
+    for i in range(writes):
+        started = time.perf_counter()
+        try:
+            # Same shape as a worker claiming a task: read, then write in one transaction.
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT id FROM contention_probe WHERE status = 'pending' ORDER BY id LIMIT 1")
+                    row = cursor.fetchone()
+                    cursor.execute(
+                        "INSERT INTO contention_probe (worker, status, payload) VALUES (%s, 'pending', %s)",
+                        [worker_no, f'{worker_no}:{i}'],
+                    )
+                    if row:
+                        cursor.execute("UPDATE contention_probe SET status = 'done' WHERE id = %s", [row[0]])
+        except OperationalError as e:
+            if 'locked' not in str(e) and 'busy' not in str(e):
+                raise
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - started)
+
+    connection.close()
+    results.put((worker_no, latencies, errors))
+
+
+class Command(BaseCommand):
+    help = 'Measure SQLite write throughput and lock errors with several concurrent writer processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=4,
+            help='Number of concurrent writer processes (default: 4)',
+        )
+        parser.add_argument(
+            '--writes',
+            type=int,
+            default=500,
+            help='Write transactions per process (default: 500)',
+        )
+        parser.add_argument(
+            '--baseline',
+            action='store_true',
+            help="Run with Django's SQLite defaults instead of the tuned profile.",
+        )
+        parser.add_argument(
+            '--path',
+            type=str,
+            default=None,
+            help='Scratch database file (default: a temporary file, removed afterwards).',
+        )
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the results as JSON.',
+        )
+
+    def handle(self, *args, **options):
+        if connections['default'].vendor != 'sqlite':
+            raise CommandError('The default database is not SQLite.')
+
+        if options['path']:
+            report = self._run(options['path'], options)
+        else:
+            scratch_dir = tempfile.mkdtemp(prefix='sqlite_contention_')
+            try:
+                report = self._run(os.path.join(scratch_dir, 'probe.sqlite3'), options)
+            finally:
+                shutil.rmtree(scratch_dir, ignore_errors=True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report))
+            return
+
+        for key, value in report.items():
+            self.stdout.write(f'{key:>12}: {value}')
+
+    def _run(self, db_path, options):
+        with sqlite3.connect(db_path) as scratch:
+            scratch.execute('DROP TABLE IF EXISTS contention_probe')
+            scratch.execute(
+                'CREATE TABLE contention_probe ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, worker INTEGER, status TEXT, payload TEXT)'
+            )
+            if options['baseline']:
+                scratch.execute('PRAGMA journal_mode = DELETE')
+        scratch.close()
+
+        # Children must open their own connections instead of inheriting ours.
+        connections.close_all()
+
+        results = multiprocessing.Queue()
+        workers = [
+            multiprocessing.Process(
+                target=_writer,
+                args=(i, db_path, options['writes'], not options['baseline'], results),
+            )
+            for i in range(options['processes'])
+        ]
+        started = time.perf_counter()
+        for process in workers:
+            process.start()
+        collected = [results.get() for _ in workers]
+        for process in workers:
+            process.join()
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for _, worker_latencies, _ in collected for latency in worker_latencies]
+        errors = sum(worker_errors for _, _, worker_errors in collected)
+        return {
+            'profile': 'baseline' if options['baseline'] else 'tuned',
+            'database': db_path,
+            'processes': options['processes'],
+            'writes': len(latencies),
+            'lock_errors': errors,
+            'elapsed_s': round(elapsed, 3),
+            'writes_per_s': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        }
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from invoices import metrics
+
+
+class Command(BaseCommand):
+    help = 'Show per-stage task timings and query counts collected by the workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--prometheus',
+            action='store_true',
+            help='Print the metrics in Prometheus text format.',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            default=None,
+            help='Write the Prometheus text to this file (e.g. for a textfile collector).',
+        )
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Clear the collected metrics.',
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            metrics.reset()
+            self.stdout.write(self.style.SUCCESS('Task metrics cleared.'))
+            return
+
+        snapshot = metrics.load()
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(metrics.render_prometheus(snapshot))
+            self.stdout.write(self.style.SUCCESS(f"Wrote metrics to {options['output']}"))
+            return
+
+        if options['prometheus']:
+            self.stdout.write(metrics.render_prometheus(snapshot), ending='')
+            return
+
+        if not snapshot['histograms']:
+            self.stdout.write(self.style.WARNING('No task metrics collected yet.'))
+            return
+
+        header = f"{'task':<40} {'stage':<16} {'count':>8} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10} {'queries':>8}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for key in sorted(snapshot['histograms']):
+            task, stage = key.split('|', 1)
+            histogram = snapshot['histograms'][key]
+            count = histogram['count']
+            mean = histogram['sum'] / count * 1000 if count else 0.0
+            p50 = metrics.quantile(histogram, 0.5) * 1000
+            p99 = metrics.quantile(histogram, 0.99) * 1000
+            queries = snapshot['queries'].get(key, 0) / count if count else 0.0
+            self.stdout.write(
+                f"{task:<40} {stage:<16} {count:>8} {mean:>10.1f} {p50:>10.0f} {p99:>10.0f} {queries:>8.1f}"
+            )
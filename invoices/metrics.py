@@ -0,0 +1,254 @@
+import contextvars
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+
+from django.conf import settings
+from django.db import connection
+
+from invoices import log
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows
+    fcntl = None
+
+# Upper bounds (seconds) of the duration histogram buckets.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Gauges published by the adaptive worker pools (invoices.autoscale): help text, label.
+GAUGES = {
+    'invoice_queue_workers': ('Workers the adaptive pool runs for the queue.', 'queue'),
+    'invoice_queue_worker_processes': ("1 if the queue's workers are processes, 0 if threads.", 'queue'),
+    'invoice_queue_worker_limit': ('Most workers the queue cost profile allows.', 'queue'),
+    'invoice_queue_pending_tasks': ('Tasks ready to run in the queue at the last decision.', 'queue'),
+    'invoice_queue_cpu_ratio': ('CPU time / wall time of recently completed tasks in the queue.', 'queue'),
+    'invoice_task_cpu_ratio': ('CPU time / wall time of a task, from its recorded cost.', 'task'),
+}
+
+_current_task = contextvars.ContextVar('current_task', default='unknown')
+_lock = threading.Lock()
+
+
+def _empty():
+    # Gauges keep the latest value per label ({name: {label: value}}); the rest are counters.
+    return {'histograms': {}, 'queries': {}, 'cpu_seconds': {}, 'gauges': {}}
+
+
+_pending = _empty()
+
+
+def _reset_after_fork():
+    # Tasks run in processes forked from threaded workers; another thread may
+    # have held the lock at fork time, and its pending metrics belong to the parent.
+    global _lock, _pending
+    _lock = threading.Lock()
+    _pending = _empty()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _empty_histogram():
+    return {'buckets': [0] * (len(BUCKETS) + 1), 'sum': 0.0, 'count': 0}
+
+
+def _observe(histogram, value):
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            histogram['buckets'][i] += 1
+            break
+    else:
+        histogram['buckets'][-1] += 1
+    histogram['sum'] += value
+    histogram['count'] += 1
+
+
+def record(task, stage, duration, queries=0):
+    key = f'{task}|{stage}'
+    with _lock:
+        _observe(_pending['histograms'].setdefault(key, _empty_histogram()), duration)
+        _pending['queries'][key] = _pending['queries'].get(key, 0) + queries
+
+
+def set_gauge(name, label, value):
+    with _lock:
+        _pending['gauges'].setdefault(name, {})[label] = value
+
+
+class timed(ContextDecorator):
+    """Time a stage of the current task and count the queries it runs."""
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def _count_query(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.queries = 0
+        self._wrapper = connection.execute_wrapper(self._count_query)
+        self._wrapper.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        duration = time.perf_counter() - self.started
+        self._wrapper.__exit__(*exc)
+        record(_current_task.get(), self.stage, duration, self.queries)
+        return False
+
+
+def instrumented(func):
+    """Record the total wall and CPU time of a task and flush its stage metrics.
+
+    Also binds the task name and its ``*_id`` arguments to the task's log records.
+    """
+
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_task.set(func.__name__)
+        cpu_started = time.process_time()
+        # invoice_id / customer_id arguments become structured log fields.
+        ids = {
+            name: value for name, value in signature.bind_partial(*args, **kwargs).arguments.items()
+            if name.endswith('_id')
+        }
+        try:
+            with log.bind(task=func.__name__, **ids), timed('total'):
+                return func(*args, **kwargs)
+        finally:
+            cpu = time.process_time() - cpu_started
+            with _lock:
+                _pending['cpu_seconds'][func.__name__] = _pending['cpu_seconds'].get(func.__name__, 0.0) + cpu
+            _current_task.reset(token)
+            # The worker runs every task in a short-lived child process, so
+            # nothing kept in memory here would survive the task.
+            flush()
+
+    return wrapper
+
+
+def _merge(target, source):
+    for key, histogram in source.get('histograms', {}).items():
+        merged = target['histograms'].setdefault(key, _empty_histogram())
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], histogram['buckets'])]
+        merged['sum'] += histogram['sum']
+        merged['count'] += histogram['count']
+    for name in ('queries', 'cpu_seconds'):
+        for key, value in source.get(name, {}).items():
+            target[name][key] = target[name].get(key, 0) + value
+    for name, series in source.get('gauges', {}).items():
+        target['gauges'].setdefault(name, {}).update(series)
+    return target
+
+
+def metrics_file():
+    return settings.TASK_METRICS_FILE
+
+
+def flush():
+    global _pending
+    with _lock:
+        pending, _pending = _pending, _empty()
+    if not pending['histograms'] and not pending['cpu_seconds'] and not pending['gauges']:
+        return
+
+    path = metrics_file()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+') as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            stored = json.loads(f.read() or '{}')
+        except json.JSONDecodeError:
+            stored = {}
+        merged = _merge(_empty(), stored)
+        _merge(merged, pending)
+        f.seek(0)
+        f.truncate()
+        json.dump(merged, f)
+
+
+def load():
+    snapshot = _empty()
+    try:
+        with open(metrics_file()) as f:
+            _merge(snapshot, json.loads(f.read() or '{}'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    with _lock:
+        _merge(snapshot, _pending)
+    return snapshot
+
+
+def reset():
+    global _pending
+    with _lock:
+        _pending = _empty()
+    try:
+        os.remove(metrics_file())
+    except FileNotFoundError:
+        pass
+
+
+def quantile(histogram, q):
+    """Estimate a quantile from bucket counts (upper bound of the matching bucket)."""
+    if not histogram['count']:
+        return 0.0
+    rank = q * histogram['count']
+    seen = 0
+    for i, count in enumerate(histogram['buckets']):
+        seen += count
+        if seen >= rank:
+            return BUCKETS[i] if i < len(BUCKETS) else float('inf')
+    return float('inf')
+
+
+def render_prometheus(snapshot=None):
+    snapshot = snapshot or load()
+    lines = [
+        '# HELP invoice_task_stage_seconds Duration of invoice task stages.',
+        '# TYPE invoice_task_stage_seconds histogram',
+    ]
+    for key in sorted(snapshot['histograms']):
+        task, stage = key.split('|', 1)
+        histogram = snapshot['histograms'][key]
+        labels = f'task="{task}",stage="{stage}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram['buckets']):
+            cumulative += count
+            lines.append(f'invoice_task_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'invoice_task_stage_seconds_sum{{{labels}}} {histogram["sum"]:.6f}')
+        lines.append(f'invoice_task_stage_seconds_count{{{labels}}} {histogram["count"]}')
+
+    lines += [
+        '# HELP invoice_task_stage_queries_total Database queries run by invoice task stages.',
+        '# TYPE invoice_task_stage_queries_total counter',
+    ]
+    for key in sorted(snapshot['queries']):
+        task, stage = key.split('|', 1)
+        lines.append(f'invoice_task_stage_queries_total{{task="{task}",stage="{stage}"}} {snapshot["queries"][key]}')
+
+    lines += [
+        '# HELP invoice_task_cpu_seconds_total CPU time spent in invoice tasks.',
+        '# TYPE invoice_task_cpu_seconds_total counter',
+    ]
+    for task in sorted(snapshot['cpu_seconds']):
+        lines.append(f'invoice_task_cpu_seconds_total{{task="{task}"}} {snapshot["cpu_seconds"][task]:.6f}')
+
+    for name in sorted(snapshot['gauges']):
+        help_text, label = GAUGES.get(name, (name, 'queue'))
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+        for value_label, value in sorted(snapshot['gauges'][name].items()):
+            lines.append(f'{name}{{{label}="{value_label}"}} {value:g}')
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_async_manager', '0001_initial'),
+        ('invoices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskIdempotencyKey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('task', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_keys', to='django_async_manager.task')),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0002_task_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskArchive',
+            fields=[
+                ('task_id', models.UUIDField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('queue', models.CharField(max_length=50)),
+                ('status', models.CharField(max_length=20)),
+                ('arguments', models.JSONField()),
+                ('created_at', models.DateTimeField()),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['name', 'created_at'], name='invoices_ta_name_79d96c_idx')],
+            },
+        ),
+    ]
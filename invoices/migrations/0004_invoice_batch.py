@@ -0,0 +1,29 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:09
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0003_task_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceBatch',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('receiving', 'Receiving'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed')], default='receiving', max_length=20)),
+                ('rows_received', models.PositiveIntegerField(default=0)),
+                ('rows_rejected', models.PositiveIntegerField(default=0)),
+                ('chunks_total', models.PositiveIntegerField(default=0)),
+                ('chunks_done', models.PositiveIntegerField(default=0)),
+                ('invoices_created', models.PositiveIntegerField(default=0)),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 5.2.1 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+def disable_legacy_report_beat(apps, schema_editor):
+    # The daily report is now fired by the periodic job dispatcher; the old
+    # beat entry would keep enqueueing it without a logical time.
+    PeriodicTask = apps.get_model('django_async_manager', 'PeriodicTask')
+    PeriodicTask.objects.filter(name='daily-invoice-report').update(enabled=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_async_manager', '0001_initial'),
+        ('invoices', '0004_invoice_batch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('shards', models.PositiveSmallIntegerField(default=1)),
+                ('invoice_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('status_counts', models.JSONField(default=dict)),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('period_start', 'period_end', 'shard'), name='unique_invoice_summary_shard')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PeriodicJobRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job', models.CharField(max_length=100)),
+                ('logical_time', models.DateTimeField()),
+                ('shards', models.PositiveSmallIntegerField(default=1)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('job', 'logical_time'), name='unique_periodic_job_run')],
+            },
+        ),
+        migrations.RunPython(disable_legacy_report_beat, migrations.RunPython.noop),
+    ]
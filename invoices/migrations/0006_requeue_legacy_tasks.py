@@ -0,0 +1,34 @@
+from django.db import migrations
+
+# Queue of every task before the render/mail/bookkeeping split: the invoice
+# tasks ran on "invoices" and the daily report on "default".
+LEGACY_QUEUES = ('invoices', 'default')
+TASK_QUEUES = {
+    'generate_invoice': 'invoices.bookkeeping',
+    'validate_invoice_data': 'invoices.bookkeeping',
+    'log_email_activity': 'invoices.bookkeeping',
+    'update_customer_communication_history': 'invoices.bookkeeping',
+    'generate_invoice_pdf': 'invoices.render',
+    'generate_daily_invoice_report': 'invoices.render',
+    'send_invoice_email': 'invoices.mail',
+}
+
+
+def requeue_legacy_tasks(apps, schema_editor):
+    # No worker serves the old queue names any more; pending tasks enqueued
+    # before the split would otherwise never run.
+    Task = apps.get_model('django_async_manager', 'Task')
+    for name, queue in TASK_QUEUES.items():
+        Task.objects.filter(status='pending', queue__in=LEGACY_QUEUES, name=name).update(queue=queue)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_async_manager', '0001_initial'),
+        ('invoices', '0005_periodic_job_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(requeue_legacy_tasks, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.utils import timezone
 
@@ -65,3 +67,91 @@ class Report(models.Model):
 
     def __str__(self):
         return f"{self.title} - {self.report_type}"
+
+class TaskIdempotencyKey(models.Model):
+    key = models.CharField(max_length=255, unique=True)
+    task = models.ForeignKey('django_async_manager.Task', on_delete=models.CASCADE, related_name='idempotency_keys')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.key} -> {self.task_id}"
+
+class TaskArchive(models.Model):
+    # Compact copy of a finished django_async_manager Task, moved out of the hot table.
+    task_id = models.UUIDField(primary_key=True)
+    name = models.CharField(max_length=255)
+    queue = models.CharField(max_length=50)
+    status = models.CharField(max_length=20)
+    arguments = models.JSONField()
+    created_at = models.DateTimeField()
+    completed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status}) - archived {self.archived_at}"
+
+class InvoiceBatch(models.Model):
+    # One streamed bulk upload; counters are bumped by the chunk tasks as they finish.
+    STATUS_CHOICES = (
+        ('receiving', 'Receiving'),
+        ('processing', 'Processing'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='receiving')
+    rows_received = models.PositiveIntegerField(default=0)
+    rows_rejected = models.PositiveIntegerField(default=0)
+    chunks_total = models.PositiveIntegerField(default=0)
+    chunks_done = models.PositiveIntegerField(default=0)
+    invoices_created = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Batch {self.id} ({self.status})"
+
+class PeriodicJobRun(models.Model):
+    # Ledger of periodic job slots: one row per (job, logical_time), claimed by
+    # whichever dispatcher gets there first. shards=0 marks the slot a job's
+    # ledger was started at, which was recorded but not run.
+    job = models.CharField(max_length=100)
+    logical_time = models.DateTimeField()
+    shards = models.PositiveSmallIntegerField(default=1)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'logical_time'], name='unique_periodic_job_run'),
+        ]
+
+    def __str__(self):
+        return f"{self.job} @ {self.logical_time}"
+
+class InvoiceSummary(models.Model):
+    # Per-shard totals of invoices created in [period_start, period_end).
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    shard = models.PositiveSmallIntegerField(default=0)
+    shards = models.PositiveSmallIntegerField(default=1)
+    invoice_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    status_counts = models.JSONField(default=dict)
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['period_start', 'period_end', 'shard'], name='unique_invoice_summary_shard'),
+        ]
+
+    def __str__(self):
+        return f"Summary {self.period_start} - {self.period_end} ({self.shard + 1}/{self.shards})"
@@ -0,0 +1,171 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections
+from django.utils import timezone
+
+from invoices.models import Invoice
+from invoices.storage import invoice_storage
+from invoices.tasks import invoice_pdf_name
+
+logger = logging.getLogger('task_worker')
+
+MANIFEST_NAME = 'manifest.csv'
+MANIFEST_HEADER = (
+    'invoice_id', 'invoice_number', 'customer', 'issue_date', 'status', 'total_amount',
+    'file', 'size', 'sha256', 'source', 'error',
+)
+COPY_SIZE = 1024 * 1024
+
+
+def archive_name(name):
+    return f'invoice_archives/{name}.zip'
+
+
+def render_missing_pdf(invoice_id):
+    # Runs in a render process; returns (invoice_id, error or None).
+    from invoices.rendering import render_invoice_pdf
+
+    try:
+        invoice = Invoice.objects.select_related('customer').prefetch_related('items').get(id=invoice_id)
+        buffer = io.BytesIO()
+        render_invoice_pdf(invoice, buffer)
+        invoice_storage().save(invoice_pdf_name(invoice), ContentFile(buffer.getvalue()))
+        return invoice_id, None
+    except Exception as e:
+        return invoice_id, f'{type(e).__name__}: {e}'
+
+
+def _add_file(archive, storage, source, arcname):
+    # Stream the PDF into the archive and hash it in the same pass.
+    digest = hashlib.sha256()
+    modified = storage.get_modified_time(source)
+    if timezone.is_aware(modified):
+        modified = timezone.localtime(modified)
+    info = zipfile.ZipInfo(arcname, date_time=modified.timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED  # PDFs are already compressed
+    with storage.open(source, 'rb') as src, archive.open(info, 'w', force_zip64=True) as dst:
+        while chunk := src.read(COPY_SIZE):
+            digest.update(chunk)
+            dst.write(chunk)
+    return info.file_size, digest.hexdigest()
+
+
+class _Unseekable:
+    # zipfile writes data descriptors instead of seeking back into a target
+    # without seek(), which lets the archive stream into an upload.
+    def __init__(self, file):
+        self.write = file.write
+        self.flush = file.flush
+
+
+def build_archive(invoices, name, chunk_size=None, processes=None):
+    """Write the PDFs of ``invoices`` plus a manifest to ``invoice_archives/<name>.zip``.
+
+    Invoices are taken in keyset pages of ``chunk_size``: PDFs already in storage are
+    reused, missing ones are rendered into it by a process pool, and each file is
+    streamed into the archive. Memory is bounded by one page; the manifest is
+    spooled to a temporary file and added last. Nothing replaces an existing
+    archive of the same name until the new one is complete.
+    """
+    chunk_size = chunk_size or settings.PDF_ARCHIVE_CHUNK_SIZE
+    processes = processes or settings.PDF_ARCHIVE_RENDER_PROCESSES
+    storage = invoice_storage()
+    target = archive_name(name)
+    try:
+        # Local storage: build next to the final file and rename it into place.
+        final_path = storage.path(target)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        partial = f'{final_path}.part'
+        output = partial
+    except NotImplementedError:
+        # Remote storage: stream into it while building. On S3 this is a
+        # multipart upload, so only the current part is buffered and the object
+        # appears once the upload completes.
+        final_path = None
+        remote = storage.open(target, 'wb')
+        output = _Unseekable(remote)
+
+    counts = {'cached': 0, 'rendered': 0, 'failed': 0}
+    pool = None
+    last_id = 0
+    try:
+        with tempfile.TemporaryFile('w+', newline='') as manifest_file, \
+                zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+            manifest = csv.writer(manifest_file)
+            manifest.writerow(MANIFEST_HEADER)
+
+            while True:
+                page = list(
+                    invoices.filter(id__gt=last_id).select_related('customer')
+                    .only('id', 'invoice_number', 'issue_date', 'status', 'total_amount', 'customer__name')
+                    .order_by('id')[:chunk_size]
+                )
+                if not page:
+                    break
+                last_id = page[-1].id
+
+                missing = {invoice.id for invoice in page if not storage.exists(invoice_pdf_name(invoice))}
+                errors = {}
+                if missing:
+                    if processes == 1:
+                        # A single renderer gains nothing from a separate process.
+                        results = map(render_missing_pdf, missing)
+                    else:
+                        if pool is None:
+                            # Forked render processes must open their own connections.
+                            connections.close_all()
+                            pool = ProcessPoolExecutor(max_workers=processes)
+                        results = pool.map(render_missing_pdf, missing)
+                    errors = {invoice_id: error for invoice_id, error in results if error}
+
+                for invoice in page:
+                    source_name = invoice_pdf_name(invoice)
+                    filename = os.path.basename(source_name)
+                    size, sha256, error = '', '', errors.get(invoice.id, '')
+                    if error:
+                        source = 'failed'
+                        logger.error("Could not render PDF for invoice %s: %s", invoice.id, error)
+                    else:
+                        source = 'rendered' if invoice.id in missing else 'cached'
+                        size, sha256 = _add_file(archive, storage, source_name, filename)
+                    counts[source] += 1
+                    manifest.writerow((
+                        invoice.id, invoice.invoice_number, invoice.customer.name, invoice.issue_date,
+                        invoice.status, invoice.total_amount, filename if not error else '',
+                        size, sha256, source, error,
+                    ))
+
+                logger.info("Archive %s: %s PDFs added so far", name, counts['cached'] + counts['rendered'])
+
+            manifest_file.seek(0)
+            info = zipfile.ZipInfo(MANIFEST_NAME, date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as dst, \
+                    io.TextIOWrapper(dst, encoding='utf-8', newline='') as text:
+                shutil.copyfileobj(manifest_file, text, COPY_SIZE)
+    except BaseException:
+        if final_path is None:
+            storage.abort_write(remote)
+        elif os.path.exists(partial):
+            os.remove(partial)
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if final_path is None:
+        remote.close()
+    else:
+        os.replace(partial, final_path)
+    return target, counts
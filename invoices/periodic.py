@@ -0,0 +1,100 @@
+import importlib
+import logging
+import math
+from datetime import datetime
+
+from croniter import croniter
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from invoices.models import Invoice, PeriodicJobRun
+
+logger = logging.getLogger('task_scheduler')
+
+
+def parse_time(value):
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+
+def invoice_window(start, end):
+    return Invoice.objects.filter(created_at__gte=start, created_at__lt=end)
+
+
+def shard_bounds(invoices, shard, shards):
+    """Split ``invoices`` into ``shards`` contiguous id ranges and return shard ``shard``'s."""
+    bounds = invoices.aggregate(low=Min('id'), high=Max('id'))
+    if bounds['low'] is None:
+        return invoices.none()
+    step = math.ceil((bounds['high'] - bounds['low'] + 1) / shards)
+    low = bounds['low'] + shard * step
+    return invoices.filter(id__gte=low, id__lt=low + step)
+
+
+def due_slots(cron, last, now, catchup):
+    """Return the schedule times after ``last`` up to ``now``, keeping the latest ``catchup``."""
+    slots = []
+    times = croniter(cron, timezone.localtime(last))
+    while (slot := times.get_next(datetime)) <= now:
+        slots.append(slot)
+    if len(slots) > catchup:
+        logger.warning("Skipping %s missed runs older than the catch-up limit of %s", len(slots) - catchup, catchup)
+        slots = slots[-catchup:]
+    return slots
+
+
+def _resolve(dotted_path):
+    module_path, name = dotted_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_path), name)
+
+
+def _enqueue(job, config, logical_time):
+    window_start = logical_time - config['window']
+    shards = 1
+    if config.get('shard_rows'):
+        rows = invoice_window(window_start, logical_time).count()
+        shards = max(1, min(config.get('max_shards', 16), math.ceil(rows / config['shard_rows'])))
+
+    task = _resolve(config['task'])
+    arguments = {'logical_time': logical_time.isoformat(), 'window_start': window_start.isoformat()}
+    try:
+        # The ledger row and the job's tasks commit together; a second dispatcher
+        # (duplicate fire, another scheduler replica) hits the unique constraint.
+        with transaction.atomic():
+            PeriodicJobRun.objects.create(job=job, logical_time=logical_time, shards=shards)
+            if config.get('shard_rows'):
+                for shard in range(shards):
+                    task(**arguments, shard=shard, shards=shards)
+            else:
+                task(**arguments)
+    except IntegrityError:
+        logger.info("Run of %s at %s was already dispatched", job, logical_time)
+        return 0
+
+    logger.info("Dispatched %s at %s in %s shard(s)", job, logical_time, shards)
+    return shards
+
+
+def dispatch_due_jobs(now=None):
+    """Enqueue every slot of settings.PERIODIC_JOBS due since its last ledger entry.
+
+    Returns the number of tasks enqueued. Missed slots (scheduler outage) are all
+    enqueued at once and run in parallel on the worker pools, up to each job's
+    ``catchup`` limit.
+    """
+    now = now or timezone.now()
+    enqueued = 0
+    for job, config in settings.PERIODIC_JOBS.items():
+        last = PeriodicJobRun.objects.filter(job=job).aggregate(last=Max('logical_time'))['last']
+        if last is None:
+            # A new job starts its ledger at the latest slot without running it,
+            # so deploying does not repeat a run the old schedule already did.
+            start = croniter(config['cron'], timezone.localtime(now)).get_prev(datetime)
+            PeriodicJobRun.objects.get_or_create(job=job, logical_time=start, defaults={'shards': 0})
+            logger.info("Started run ledger for %s at %s", job, start)
+            continue
+
+        for slot in due_slots(config['cron'], last, now, config.get('catchup', 1)):
+            enqueued += _enqueue(job, config, slot)
+    return enqueued
@@ -0,0 +1,96 @@
+# reportlab costs ~150ms to import, so only processes that actually render load
+# this module: tasks import it on first use and the render worker pool preloads
+# it once so forked task children inherit it (see TASK_QUEUES in settings).
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+
+
+def render_invoice_pdf(invoice, target):
+    doc = SimpleDocTemplate(target, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+
+    title_style = styles["Heading1"]
+    elements.append(Paragraph(f"Invoice {invoice.invoice_number}", title_style))
+    elements.append(Spacer(1, 0.25*inch))
+
+    normal_style = styles["Normal"]
+    elements.append(Paragraph(f"<b>Customer:</b> {invoice.customer.name}", normal_style))
+    elements.append(Paragraph(f"<b>Email:</b> {invoice.customer.email}", normal_style))
+    elements.append(Paragraph(f"<b>Address:</b> {invoice.customer.address}", normal_style))
+    elements.append(Spacer(1, 0.1*inch))
+    elements.append(Paragraph(f"<b>Issue Date:</b> {invoice.issue_date}", normal_style))
+    elements.append(Paragraph(f"<b>Due Date:</b> {invoice.due_date}", normal_style))
+    elements.append(Paragraph(f"<b>Status:</b> {invoice.get_status_display()}", normal_style))
+    elements.append(Spacer(1, 0.25*inch))
+
+    items_data = [["Description", "Quantity", "Unit Price", "Total"]]
+    for item in invoice.items.all():
+        items_data.append([
+            item.description,
+            str(item.quantity),
+            f"${item.unit_price}",
+            f"${item.total}"
+        ])
+
+    items_data.append(["", "", "Total:", f"${invoice.total_amount}"])
+
+    table = Table(items_data, colWidths=[4*inch, 1*inch, 1.25*inch, 1.25*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
+        ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+        ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -2), 1, colors.black),
+        ('LINEBELOW', (0, -1), (-1, -1), 1, colors.black),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ]))
+    elements.append(table)
+
+    elements.append(Spacer(1, 0.5*inch))
+    elements.append(Paragraph("Thank you!", normal_style))
+
+    doc.build(elements)
+
+
+def render_invoice_report(target, invoices, start_time, end_time, title="Daily Invoice Report"):
+    doc = SimpleDocTemplate(target, pagesize=letter)
+    styles = getSampleStyleSheet()
+    elements = []
+
+    elements.append(Paragraph(title, styles['Heading1']))
+    elements.append(Paragraph(f"Period: {start_time.date()} – {end_time.date()}", styles['Normal']))
+    elements.append(Spacer(1, 0.2 * inch))
+
+    table_data = [["Invoice #", "Issue Date", "Customer", "Amount", "Status"]]
+    for inv in invoices:
+        table_data.append([
+            inv.invoice_number,
+            str(inv.issue_date),
+            inv.customer.name,
+            f"{inv.total_amount:.2f}",
+            inv.get_status_display()
+        ])
+
+    table = Table(table_data, colWidths=[1.5*inch, 1.5*inch, 2.5*inch, 1*inch, 1*inch])
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+        ('ALIGN', (3, 1), (4, -1), 'RIGHT'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+    ]))
+    elements.append(table)
+    elements.append(Spacer(1, 0.3 * inch))
+    elements.append(Paragraph("End of report", styles['Normal']))
+
+    doc.build(elements)
@@ -0,0 +1,178 @@
+import random
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, time as dt_time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from django_async_manager.models import Task
+
+from invoices.models import Customer, Invoice, InvoiceItem
+from invoices.tasks import BOOKKEEPING_QUEUE, MAIL_QUEUE, RENDER_QUEUE
+
+# Realistic-ish shape of production data: most invoices are small, most are
+# already sent or paid, and a minority of customers get most of the invoices.
+ITEM_COUNT_WEIGHTS = {1: 30, 2: 25, 3: 18, 4: 10, 5: 7, 6: 4, 7: 2, 8: 2, 9: 1, 10: 1}
+STATUS_WEIGHTS = {'draft': 15, 'sent': 45, 'paid': 30, 'cancelled': 5, 'closed': 5}
+DUE_DAYS = (14, 30, 30, 30, 45, 60)
+DESCRIPTIONS = (
+    'Service fee', 'Consultation', 'Hosting', 'Support plan', 'License', 'Maintenance',
+    'Training', 'Development', 'Design work', 'Shipping', 'Hardware', 'Audit',
+)
+SEND_CHAIN = (
+    ('validate_invoice_data', BOOKKEEPING_QUEUE, 3),
+    ('generate_invoice_pdf', RENDER_QUEUE, 3),
+    ('log_email_activity', BOOKKEEPING_QUEUE, 1),
+    ('update_customer_communication_history', BOOKKEEPING_QUEUE, 2),
+)
+
+_customer_ids = []
+
+# Task ids are derived from the invoice number, which the command checks is
+# unused, so a rerun with another --prefix or --seed never collides.
+TASK_ID_NAMESPACE = uuid.UUID('4f0e5a52-8d3c-4b8e-9f57-6a1d2c9b7e31')
+
+
+@contextmanager
+def manual_timestamps():
+    # created_at/updated_at are auto fields; seeded rows need historical values.
+    fields = [Invoice._meta.get_field('created_at'), Invoice._meta.get_field('updated_at')]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
+
+
+def seed_customers(count, seed, chunk_size=5000):
+    rng = random.Random(f'customers:{seed}')
+    ids = []
+    for start in range(0, count, chunk_size):
+        batch = [
+            Customer(
+                name=f'Customer {seed}-{i}',
+                email=f'customer{seed}.{i}@example.com',
+                address=f'{rng.randint(1, 999)} Market Street, Suite {rng.randint(1, 50)}',
+            )
+            for i in range(start, min(start + chunk_size, count))
+        ]
+        ids.extend(c.pk for c in Customer.objects.bulk_create(batch))
+    return ids
+
+
+def init_worker(customer_ids):
+    global _customer_ids
+    _customer_ids = customer_ids
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights), weights=list(weights.values()))[0]
+
+
+def task_id(invoice_number, name):
+    return uuid.uuid5(TASK_ID_NAMESPACE, f'{invoice_number}:{name}')
+
+
+def _task(rng, invoice_number, name, queue, priority, args, created_at, status='completed'):
+    started_at = created_at + timedelta(seconds=rng.uniform(0.1, 30))
+    return Task(
+        id=task_id(invoice_number, name),
+        name=name,
+        queue=queue,
+        priority=priority,
+        status=status,
+        arguments={'args': args, 'kwargs': {}},
+        created_at=created_at,
+        started_at=started_at,
+        completed_at=started_at + timedelta(seconds=rng.uniform(0.01, 5)),
+        attempts=1,
+        worker_id=f'worker-{queue}-{rng.randint(1, 4)}',
+    )
+
+
+def seed_chunk(chunk):
+    chunk_no, start, count, seed, prefix, days, with_tasks = chunk
+    # One RNG per chunk keeps the output identical whatever the process count.
+    rng = random.Random(f'invoices:{seed}:{chunk_no}')
+    today = timezone.now().date()
+    tz = timezone.get_current_timezone()
+
+    invoices, items_per_invoice = [], []
+    for index in range(start, start + count):
+        # Skewed pick: the first 10% of customers get almost half of the invoices.
+        customer_id = _customer_ids[int(len(_customer_ids) * rng.random() ** 3)]
+        issue_date = today - timedelta(days=rng.randrange(days))
+        created_at = datetime.combine(issue_date, dt_time(rng.randrange(8, 18), rng.randrange(60)), tzinfo=tz)
+
+        items = []
+        for _ in range(_weighted(rng, ITEM_COUNT_WEIGHTS)):
+            items.append(InvoiceItem(
+                description=rng.choice(DESCRIPTIONS),
+                quantity=rng.choice((1, 1, 1, 2, 2, 3, 5, 10)),
+                unit_price=Decimal(str(round(min(rng.lognormvariate(4.5, 1.0), 99999), 2))),
+            ))
+
+        invoices.append(Invoice(
+            invoice_number=f'{prefix}-{seed}-{index:09d}',
+            customer_id=customer_id,
+            issue_date=issue_date,
+            due_date=issue_date + timedelta(days=rng.choice(DUE_DAYS)),
+            status=_weighted(rng, STATUS_WEIGHTS),
+            total_amount=sum(item.quantity * item.unit_price for item in items),
+            created_at=created_at,
+            updated_at=created_at,
+        ))
+        items_per_invoice.append(items)
+
+    with transaction.atomic(), manual_timestamps():
+        Invoice.objects.bulk_create(invoices)
+        for invoice, items in zip(invoices, items_per_invoice):
+            for item in items:
+                item.invoice_id = invoice.pk
+        InvoiceItem.objects.bulk_create([item for items in items_per_invoice for item in items])
+
+        task_count = 0
+        if with_tasks:
+            tasks, dependencies = [], []
+            for invoice in invoices:
+                tasks.append(_task(
+                    rng, invoice.invoice_number, 'generate_invoice', BOOKKEEPING_QUEUE, 3,
+                    [invoice.customer_id], invoice.created_at,
+                ))
+                if invoice.status == 'draft':
+                    continue
+                sent_at = invoice.created_at + timedelta(minutes=5)
+                chain = [
+                    _task(rng, invoice.invoice_number, name, queue, priority, [invoice.pk], sent_at)
+                    for name, queue, priority in SEND_CHAIN
+                ]
+                send = _task(rng, invoice.invoice_number, 'send_invoice_email', MAIL_QUEUE, 2, [invoice.pk], sent_at)
+                tasks.extend(chain + [send])
+                dependencies.extend(
+                    Task.dependencies.through(from_task_id=send.id, to_task_id=dep.id) for dep in chain
+                )
+            Task.objects.bulk_create(tasks)
+            Task.dependencies.through.objects.bulk_create(dependencies)
+            task_count = len(tasks)
+
+    return chunk_no, len(invoices), sum(len(items) for items in items_per_invoice), task_count
+
+
+def remove_seeded(prefix, seed, customer_ids, chunk_size=5000):
+    """Delete what a failed parallel run committed: its tasks, then its customers
+    (which cascades to their invoices and items)."""
+    names = ['generate_invoice', 'send_invoice_email', *(name for name, _, _ in SEND_CHAIN)]
+    numbers = Invoice.objects.filter(invoice_number__startswith=f'{prefix}-{seed}-').values_list('invoice_number', flat=True)
+    batch = []
+    for number in numbers.iterator(chunk_size=chunk_size):
+        batch.extend(task_id(number, name) for name in names)
+        if len(batch) >= chunk_size:
+            Task.objects.filter(id__in=batch).delete()
+            batch = []
+    Task.objects.filter(id__in=batch).delete()
+    for start in range(0, len(customer_ids), chunk_size):
+        Customer.objects.filter(id__in=customer_ids[start:start + chunk_size]).delete()
@@ -0,0 +1,35 @@
+import sys
+
+from django.conf import settings
+from django.db import connections
+
+# Connections and pools inherited from the parent, kept referenced so they are
+# never finalized (which would end the parent's sessions) in a forked child.
+_inherited = []
+
+
+def configure_sqlite_connection(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def discard_inherited_connections():
+    """Run in forked children: forget the parent's database connections and pools.
+
+    Their sockets are shared with the parent, so the child must neither use nor
+    close them (closing a pooled connection would even hand it back to the
+    parent's pool from another process). The child opens its own on first use.
+    """
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            _inherited.append(connection.connection)
+            connection.connection = None
+    postgresql = sys.modules.get('django.db.backends.postgresql.base')
+    if postgresql is not None and postgresql.DatabaseWrapper._connection_pools:
+        _inherited.append(dict(postgresql.DatabaseWrapper._connection_pools))
+        postgresql.DatabaseWrapper._connection_pools.clear()
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+from datetime import datetime
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+
+# Alias in settings.STORAGES for PDFs, reports, e-mail logs and communication history.
+STORAGE_ALIAS = 'invoice_files'
+
+# Read once: os.umask() can only be queried by setting it, which is not thread-safe.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def invoice_storage():
+    return storages[STORAGE_ALIAS]
+
+
+class ShardedStorageMixin:
+    """Spread files of a directory over nested subdirectories.
+
+    ``shard('invoice_pdfs', 'invoice_X.pdf')`` gives ``invoice_pdfs/3f/a2/invoice_X.pdf``
+    (from a hash of the file name, so the name can be recomputed at any time) and
+    ``shard('invoice_reports', name, date=day)`` gives ``invoice_reports/2026/10/19/<name>``.
+    """
+
+    def __init__(self, *args, shard_depth=2, shard_width=2, **kwargs):
+        self.shard_depth = shard_depth
+        self.shard_width = shard_width
+        super().__init__(*args, **kwargs)
+
+    def shard(self, directory, filename, date=None):
+        if date is not None:
+            parts = [f'{date:%Y}', f'{date:%m}', f'{date:%d}']
+        else:
+            digest = hashlib.md5(filename.encode()).hexdigest()
+            parts = [
+                digest[i * self.shard_width:(i + 1) * self.shard_width]
+                for i in range(self.shard_depth)
+            ]
+        return '/'.join([directory, *parts, filename])
+
+
+class ShardedFileSystemStorage(ShardedStorageMixin, FileSystemStorage):
+    """Local sharded storage whose writes are atomic and replace existing files.
+
+    Content goes to a temporary file in the target directory, which is then
+    renamed over the final name, so readers see either the old or the new file.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._known_dirs = set()
+
+    def get_available_name(self, name, max_length=None):
+        # Saving a name again replaces the file instead of picking a new name.
+        return self.generate_filename(name)
+
+    def _ensure_directory(self, directory):
+        # Shard directories are created once; later writes skip the makedirs syscalls.
+        if directory in self._known_dirs:
+            return
+        if self.directory_permissions_mode is not None:
+            old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+            try:
+                os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+            finally:
+                os.umask(old_umask)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self._known_dirs.add(directory)
+
+    def _save(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        self._ensure_directory(directory)
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        except FileNotFoundError:
+            # The directory was removed behind our back; forget it and recreate it.
+            self._known_dirs.discard(directory)
+            self._ensure_directory(directory)
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in content.chunks():
+                    f.write(chunk.encode() if isinstance(chunk, str) else chunk)
+            # mkstemp creates 0600 files; give them the usual umask-based mode instead.
+            os.chmod(tmp_path, self.file_permissions_mode or 0o666 & ~_UMASK)
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        return os.path.relpath(full_path, self.location).replace('\\', '/')
+
+
+
+# Files that tasks wrote straight into these directories before they went
+# through invoice_storage(). E-mail logs are left alone: nothing reads them.
+FLAT_DIRECTORIES = ('invoice_pdfs', 'customer_communications', 'invoice_reports')
+_REPORT_DATE = re.compile(r'_(\d{8})\.pdf$')
+
+
+def sharded_name(storage, directory, filename):
+    if directory == 'invoice_reports':
+        match = _REPORT_DATE.search(filename)
+        if not match:
+            return None
+        return storage.shard(directory, filename, date=datetime.strptime(match[1], '%Y%m%d').date())
+    return storage.shard(directory, filename)
+
+
+def migrate_flat_files(source, storage, dry_run=False):
+    """Move files of the flat layout under ``source`` to their sharded names in ``storage``.
+
+    Yields ``(old name, new name)`` per file. A communication history that has
+    already been started in the new layout gets the old entries prepended.
+    """
+    flat = FileSystemStorage(location=source)
+    for directory in FLAT_DIRECTORIES:
+        if not flat.exists(directory):
+            continue
+        for filename in sorted(flat.listdir(directory)[1]):
+            old = f'{directory}/{filename}'
+            new = sharded_name(storage, directory, filename)
+            if new is None or filename.startswith('.'):
+                continue
+            yield old, new
+            if dry_run:
+                continue
+            if directory == 'customer_communications' and storage.exists(new):
+                with flat.open(old, 'rb') as f:
+                    history = json.load(f)
+                with storage.open(new, 'rb') as f:
+                    history['communications'] += json.load(f)['communications']
+                storage.save(new, ContentFile(json.dumps(history, indent=2)))
+            else:
+                with flat.open(old, 'rb') as f:
+                    storage.save(new, File(f))
+            flat.delete(old)
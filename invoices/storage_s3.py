@@ -0,0 +1,20 @@
+# Imported only when settings.STORAGES selects it, so django-storages and boto3
+# stay optional (pip install "django-storages[s3]").
+from storages.backends.s3 import S3Storage
+
+from invoices.storage import ShardedStorageMixin
+
+
+class ShardedS3Storage(ShardedStorageMixin, S3Storage):
+    # An S3 PUT creates the object atomically and file_overwrite defaults to
+    # True, so only the sharded layout is added here.
+
+    def abort_write(self, file):
+        # A file opened with open(name, 'wb') uploads parts as its buffer fills
+        # and completes the upload on close(). Aborting instead leaves any
+        # existing object untouched.
+        if file._multipart is not None:
+            file._multipart.abort()
+            file._multipart = None
+        file._is_dirty = False
+        file.close()
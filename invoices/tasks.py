@@ -1,27 +1,37 @@
+import io
 import logging
 import random
 import os
+import tempfile
 from datetime import datetime, timedelta
 from decimal import Decimal
 import json
 import hashlib
 
 from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Count, F, Sum
 from django.core.mail import EmailMessage
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
 from django_async_manager.decorators import background_task
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
 
-from invoices.models import Customer, Invoice, InvoiceItem, Report
+from invoices.metrics import instrumented, timed
+from invoices.periodic import dispatch_due_jobs, invoice_window, parse_time, shard_bounds
+from invoices.models import Customer, Invoice, InvoiceBatch, InvoiceItem, InvoiceSummary, Report
+from invoices.storage import invoice_storage
 
 logger = logging.getLogger('task_worker')
 
+# Queue topology, sized per queue in settings.TASK_QUEUES: CPU-heavy rendering,
+# slow SMTP sends and cheap bookkeeping writes never wait behind each other.
+RENDER_QUEUE = 'invoices.render'
+MAIL_QUEUE = 'invoices.mail'
+BOOKKEEPING_QUEUE = 'invoices.bookkeeping'
+
 
 def generate_invoice_number():
     prefix = "INV"
@@ -30,12 +40,19 @@ def generate_invoice_number():
     return f"{prefix}-{timestamp}-{random_suffix}"
 
 
-@background_task(priority="high", queue="invoices")
+def invoice_pdf_name(invoice):
+    filename = f"invoice_{invoice.invoice_number.replace('-', '_')}.pdf"
+    return invoice_storage().shard('invoice_pdfs', filename)
+
+
+@background_task(priority="high", queue=BOOKKEEPING_QUEUE)
+@instrumented
 def generate_invoice(customer_id, items_data=None, due_days=30):
-    logger.info(f"Generating invoice for customer {customer_id}")
+    logger.info("Generating invoice for customer %s", customer_id)
 
     try:
-        customer = Customer.objects.get(id=customer_id)
+        with timed('db_load'):
+            customer = Customer.objects.get(id=customer_id)
 
         if not items_data:
             items_data = [
@@ -48,164 +65,197 @@ def generate_invoice(customer_id, items_data=None, due_days=30):
             for item in items_data
         )
 
-        invoice = Invoice.objects.create(
-            invoice_number=generate_invoice_number(),
-            customer=customer,
-            issue_date=timezone.now().date(),
-            due_date=timezone.now().date() + timedelta(days=due_days),
-            status='draft',
-            total_amount=total_amount
-        )
-
-        for item_data in items_data:
-            InvoiceItem.objects.create(
-                invoice=invoice,
-                description=item_data["description"],
-                quantity=item_data["quantity"],
-                unit_price=item_data["unit_price"]
+        with timed('db_write'):
+            invoice = Invoice.objects.create(
+                invoice_number=generate_invoice_number(),
+                customer=customer,
+                issue_date=timezone.now().date(),
+                due_date=timezone.now().date() + timedelta(days=due_days),
+                status='draft',
+                total_amount=total_amount
             )
 
-        logger.info(f"Successfully generated invoice {invoice.invoice_number}")
+            for item_data in items_data:
+                InvoiceItem.objects.create(
+                    invoice=invoice,
+                    description=item_data["description"],
+                    quantity=item_data["quantity"],
+                    unit_price=item_data["unit_price"]
+                )
+
+        logger.info("Successfully generated invoice %s", invoice.invoice_number)
         return invoice
 
     except Customer.DoesNotExist:
-        logger.error(f"Customer with ID {customer_id} does not exist")
+        logger.error("Customer with ID %s does not exist", customer_id)
         raise
     except Exception as e:
-        logger.error(f"Error generating invoice: {str(e)}")
+        logger.error("Error generating invoice: %s", e)
+        raise
+
+
+
+def complete_invoice_batch(batch_id):
+    # Called by the ingest and by every chunk task; whichever sees the last chunk done wins.
+    InvoiceBatch.objects.filter(
+        pk=batch_id, status='processing', chunks_done=F('chunks_total')
+    ).update(status='completed')
+
+
+def fail_invoice_batch(batch_id, chunk_no, error):
+    with transaction.atomic():
+        batch = InvoiceBatch.objects.select_for_update().get(pk=batch_id)
+        batch.errors.append({'chunk': chunk_no, 'error': error})
+        batch.status = 'failed'
+        batch.save(update_fields=['status', 'errors', 'updated_at'])
+
+
+# No autoretry: a chunk that raises fails its batch straight away.
+@background_task(priority="medium", queue=BOOKKEEPING_QUEUE, autoretry=False)
+@instrumented
+def generate_invoices_bulk(batch_id, chunk_no, rows):
+    # rows are [row_index, customer_id, items, due_days] lists validated by
+    # invoices.ingest. Invoice numbers derive from the batch id and row index,
+    # so a rerun chunk recognises the invoices it already created.
+    if not InvoiceBatch.objects.filter(pk=batch_id, status='processing').exists():
+        logger.warning("Batch %s is not processing, skipping chunk %s", batch_id, chunk_no)
+        return 0
+    try:
+        return _generate_invoice_chunk(batch_id, chunk_no, rows)
+    except Exception as e:
+        logger.error("Batch %s chunk %s failed: %s", batch_id, chunk_no, e)
+        fail_invoice_batch(batch_id, chunk_no, str(e))
         raise
 
 
+def _generate_invoice_chunk(batch_id, chunk_no, rows):
+    logger.info("Generating %s invoices for batch %s chunk %s", len(rows), batch_id, chunk_no)
+
+    prefix = f"INV-{batch_id.replace('-', '').upper()}"
+    numbers = [f"{prefix}-{row_index:07d}" for row_index, _, _, _ in rows]
+    if Invoice.objects.filter(invoice_number__in=numbers).exists():
+        logger.warning("Batch %s chunk %s was already created, skipping", batch_id, chunk_no)
+        return 0
+
+    today = timezone.now().date()
+    invoices, items_per_invoice = [], []
+    for number, (_, customer_id, items_data, due_days) in zip(numbers, rows):
+        items = [
+            InvoiceItem(
+                description=item["description"],
+                quantity=item["quantity"],
+                unit_price=Decimal(item["unit_price"]),
+            )
+            for item in items_data
+        ]
+        invoices.append(Invoice(
+            invoice_number=number,
+            customer_id=customer_id,
+            issue_date=today,
+            due_date=today + timedelta(days=due_days),
+            status='draft',
+            total_amount=sum(item.quantity * item.unit_price for item in items),
+        ))
+        items_per_invoice.append(items)
+
+    with timed('db_write'), transaction.atomic():
+        Invoice.objects.bulk_create(invoices)
+        for invoice, items in zip(invoices, items_per_invoice):
+            for item in items:
+                item.invoice_id = invoice.pk
+        InvoiceItem.objects.bulk_create([item for items in items_per_invoice for item in items])
+        InvoiceBatch.objects.filter(pk=batch_id).update(
+            chunks_done=F('chunks_done') + 1,
+            invoices_created=F('invoices_created') + len(invoices),
+        )
+    complete_invoice_batch(batch_id)
+
+    logger.info("Created %s invoices for batch %s chunk %s", len(invoices), batch_id, chunk_no)
+    return len(invoices)
+
 
-@background_task(priority="high", queue="invoices")
+@background_task(priority="high", queue=BOOKKEEPING_QUEUE)
+@instrumented
 def validate_invoice_data(invoice_id):
-    logger.info(f"Validating invoice data for invoice {invoice_id}")
+    logger.info("Validating invoice data for invoice %s", invoice_id)
 
     try:
-        invoice = Invoice.objects.select_related('customer').prefetch_related('items').get(id=invoice_id)
+        with timed('db_load'):
+            invoice = Invoice.objects.select_related('customer').prefetch_related('items').get(id=invoice_id)
 
         if not invoice.items.exists():
-            logger.error(f"Invoice {invoice.invoice_number} has no items")
+            logger.error("Invoice %s has no items", invoice.invoice_number)
             raise ValidationError("Invoice has no items")
 
         if not invoice.customer.email:
-            logger.error(f"Customer {invoice.customer.name} has no email address")
+            logger.error("Customer %s has no email address", invoice.customer.name)
             raise ValidationError("Customer has no email address")
 
         calculated_total = sum(item.total for item in invoice.items.all())
         if abs(calculated_total - invoice.total_amount) > Decimal('0.01'):
-            logger.error(f"Invoice {invoice.invoice_number} total amount mismatch: {invoice.total_amount} vs calculated {calculated_total}")
+            logger.error("Invoice %s total amount mismatch: %s vs calculated %s", invoice.invoice_number, invoice.total_amount, calculated_total)
             raise ValidationError("Invoice total amount mismatch")
 
         if invoice.issue_date > invoice.due_date:
-            logger.error(f"Invoice {invoice.invoice_number} issue date {invoice.issue_date} is after due date {invoice.due_date}")
+            logger.error("Invoice %s issue date %s is after due date %s", invoice.invoice_number, invoice.issue_date, invoice.due_date)
             raise ValidationError("Invoice issue date is after due date")
 
-        logger.info(f"Invoice {invoice.invoice_number} validation successful")
+        logger.info("Invoice %s validation successful", invoice.invoice_number)
         return invoice
 
     except Invoice.DoesNotExist:
-        logger.error(f"Invoice with ID {invoice_id} does not exist")
+        logger.error("Invoice with ID %s does not exist", invoice_id)
         raise
     except ValidationError as e:
-        logger.error(f"Validation error for invoice {invoice_id}: {str(e)}")
+        logger.error("Validation error for invoice %s: %s", invoice_id, e)
         raise
     except Exception as e:
-        logger.error(f"Error validating invoice {invoice_id}: {str(e)}")
+        logger.error("Error validating invoice %s: %s", invoice_id, e)
         raise
 
 
-@background_task(priority="high", queue="invoices")
+@background_task(priority="high", queue=RENDER_QUEUE)
+@instrumented
 def generate_invoice_pdf(invoice_id):
-    logger.info(f"Generating PDF for invoice {invoice_id}")
+    logger.info("Generating PDF for invoice %s", invoice_id)
 
     try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.lib import colors
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-
-        invoice = Invoice.objects.select_related('customer').prefetch_related('items').get(id=invoice_id)
-
-        pdf_dir = os.path.join(settings.BASE_DIR, 'invoice_pdfs')
-        os.makedirs(pdf_dir, exist_ok=True)
-
-        filename = f"invoice_{invoice.invoice_number.replace('-', '_')}.pdf"
-        filepath = os.path.join(pdf_dir, filename)
-
-        doc = SimpleDocTemplate(filepath, pagesize=letter)
-        styles = getSampleStyleSheet()
-        elements = []
-
-        title_style = styles["Heading1"]
-        elements.append(Paragraph(f"Invoice {invoice.invoice_number}", title_style))
-        elements.append(Spacer(1, 0.25*inch))
-
-        normal_style = styles["Normal"]
-        elements.append(Paragraph(f"<b>Customer:</b> {invoice.customer.name}", normal_style))
-        elements.append(Paragraph(f"<b>Email:</b> {invoice.customer.email}", normal_style))
-        elements.append(Paragraph(f"<b>Address:</b> {invoice.customer.address}", normal_style))
-        elements.append(Spacer(1, 0.1*inch))
-        elements.append(Paragraph(f"<b>Issue Date:</b> {invoice.issue_date}", normal_style))
-        elements.append(Paragraph(f"<b>Due Date:</b> {invoice.due_date}", normal_style))
-        elements.append(Paragraph(f"<b>Status:</b> {invoice.get_status_display()}", normal_style))
-        elements.append(Spacer(1, 0.25*inch))
-
-        items_data = [["Description", "Quantity", "Unit Price", "Total"]]
-        for item in invoice.items.all():
-            items_data.append([
-                item.description,
-                str(item.quantity),
-                f"${item.unit_price}",
-                f"${item.total}"
-            ])
-
-        items_data.append(["", "", "Total:", f"${invoice.total_amount}"])
-
-        table = Table(items_data, colWidths=[4*inch, 1*inch, 1.25*inch, 1.25*inch])
-        table.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 12),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -2), colors.beige),
-            ('TEXTCOLOR', (0, 1), (-1, -1), colors.black),
-            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-            ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-            ('FONTNAME', (0, -1), (-1, -1), 'Helvetica-Bold'),
-            ('GRID', (0, 0), (-1, -2), 1, colors.black),
-            ('LINEBELOW', (0, -1), (-1, -1), 1, colors.black),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(table)
-
-        elements.append(Spacer(1, 0.5*inch))
-        elements.append(Paragraph("Thank you!", normal_style))
-
-        doc.build(elements)
-
-        file_hash = hashlib.md5(open(filepath, 'rb').read()).hexdigest()
-
-        logger.info(f"Successfully generated PDF for invoice {invoice.invoice_number} at {filepath}")
-        return filepath
+        from invoices.rendering import render_invoice_pdf
+
+        with timed('db_load'):
+            invoice = Invoice.objects.select_related('customer').prefetch_related('items').get(id=invoice_id)
+
+        # PDFs are a few KB, so they are rendered in memory and stored in one write.
+        buffer = io.BytesIO()
+        with timed('render'):
+            render_invoice_pdf(invoice, buffer)
+        pdf = buffer.getvalue()
+
+        with timed('hash'):
+            file_hash = hashlib.md5(pdf).hexdigest()
+
+        with timed('file_io'):
+            name = invoice_storage().save(invoice_pdf_name(invoice), ContentFile(pdf))
+
+        logger.info("Successfully generated PDF for invoice %s at %s", invoice.invoice_number, name)
+        return name
 
     except Invoice.DoesNotExist:
-        logger.error(f"Invoice with ID {invoice_id} does not exist")
+        logger.error("Invoice with ID %s does not exist", invoice_id)
         raise
     except Exception as e:
-        logger.error(f"Error generating PDF for invoice {invoice_id}: {str(e)}")
+        logger.error("Error generating PDF for invoice %s: %s", invoice_id, e)
         raise
 
 
-@background_task(priority="low", queue="invoices")
+@background_task(priority="low", queue=BOOKKEEPING_QUEUE)
+@instrumented
 def log_email_activity(invoice_id, recipient_email=None, status="sent"):
-    logger.info(f"Logging email activity for invoice {invoice_id}")
+    logger.info("Logging email activity for invoice %s", invoice_id)
 
     try:
-        invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
+        with timed('db_load'):
+            invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
 
         if recipient_email is None:
             recipient_email = invoice.customer.email
@@ -220,129 +270,93 @@ def log_email_activity(invoice_id, recipient_email=None, status="sent"):
             "amount": str(invoice.total_amount)
         }
 
-        log_dir = os.path.join(settings.BASE_DIR, 'email_logs')
-        os.makedirs(log_dir, exist_ok=True)
+        # One entry per file, sharded by day: the storage API has no append,
+        # and separate files never contend between workers.
+        with timed('file_io'):
+            now = timezone.now()
+            storage = invoice_storage()
+            name = storage.shard('email_logs', f"invoice_{invoice_id}_{now:%H%M%S%f}.json", date=now.date())
+            storage.save(name, ContentFile(json.dumps(log_entry) + "\n"))
 
-        log_file = os.path.join(log_dir, 'email_activity.log')
-        with open(log_file, 'a') as f:
-            f.write(json.dumps(log_entry) + "\n")
-
-        logger.info(f"Successfully logged email activity for invoice {invoice.invoice_number}")
+        logger.info("Successfully logged email activity for invoice %s", invoice.invoice_number)
         return True
 
     except Invoice.DoesNotExist:
-        logger.error(f"Invoice with ID {invoice_id} does not exist")
+        logger.error("Invoice with ID %s does not exist", invoice_id)
         raise
     except Exception as e:
-        logger.error(f"Error logging email activity for invoice {invoice_id}: {str(e)}")
+        logger.error("Error logging email activity for invoice %s: %s", invoice_id, e)
         raise
 
 
-@background_task(priority="medium", queue="invoices")
+@background_task(priority="medium", queue=BOOKKEEPING_QUEUE)
+@instrumented
 def update_customer_communication_history(invoice_id, communication_type="email"):
-    logger.info(f"Updating communication history for invoice {invoice_id}")
+    logger.info("Updating communication history for invoice %s", invoice_id)
 
     try:
-        invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
+        with timed('db_load'):
+            invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
         customer = invoice.customer
         customer_id = customer.id
 
-        logger.info(f"Updating communication history for customer {customer.name} (ID: {customer_id})")
-
-        comm_dir = os.path.join(settings.BASE_DIR, 'customer_communications')
-        os.makedirs(comm_dir, exist_ok=True)
-
-        customer_file = os.path.join(comm_dir, f'customer_{customer_id}.json')
-
-        if os.path.exists(customer_file):
-            with open(customer_file, 'r') as f:
-                try:
-                    history = json.load(f)
-                except json.JSONDecodeError:
-                    history = {"communications": []}
-        else:
-            history = {"communications": []}
-
-        history["communications"].append({
-            "timestamp": timezone.now().isoformat(),
-            "type": communication_type,
-            "invoice_id": invoice_id,
-            "invoice_number": invoice.invoice_number,
-            "amount": str(invoice.total_amount),
-            "status": "sent"
-        })
+        logger.info("Updating communication history for customer %s (ID: %s)", customer.name, customer_id)
 
-        with open(customer_file, 'w') as f:
-            json.dump(history, f, indent=2)
+        with timed('file_io'):
+            storage = invoice_storage()
+            customer_file = storage.shard('customer_communications', f'customer_{customer_id}.json')
 
-        logger.info(f"Successfully updated communication history for customer {customer.name}")
+            if storage.exists(customer_file):
+                with storage.open(customer_file, 'rb') as f:
+                    try:
+                        history = json.load(f)
+                    except json.JSONDecodeError:
+                        history = {"communications": []}
+            else:
+                history = {"communications": []}
+
+            history["communications"].append({
+                "timestamp": timezone.now().isoformat(),
+                "type": communication_type,
+                "invoice_id": invoice_id,
+                "invoice_number": invoice.invoice_number,
+                "amount": str(invoice.total_amount),
+                "status": "sent"
+            })
+
+            storage.save(customer_file, ContentFile(json.dumps(history, indent=2)))
+
+        logger.info("Successfully updated communication history for customer %s", customer.name)
         return True
 
     except Invoice.DoesNotExist:
-        logger.error(f"Invoice with ID {invoice_id} does not exist")
+        logger.error("Invoice with ID %s does not exist", invoice_id)
         raise
     except Exception as e:
-        logger.error(f"Error updating communication history for invoice {invoice_id}: {str(e)}")
+        logger.error("Error updating communication history for invoice %s: %s", invoice_id, e)
         raise
 
 
-@background_task(priority="medium", queue="invoices", 
-                dependencies=[validate_invoice_data, generate_invoice_pdf, 
+@background_task(priority="medium", queue=MAIL_QUEUE,
+                dependencies=[validate_invoice_data, generate_invoice_pdf,
                              log_email_activity, update_customer_communication_history])
+@instrumented
 def send_invoice_email(invoice_id, document_path=None):
-    logger.info(f"Sending invoice {invoice_id} via real email")
+    logger.info("Sending invoice %s via real email", invoice_id)
 
     try:
-        from django_async_manager.models import Task
-        invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
+        with timed('db_load'):
+            invoice = Invoice.objects.select_related('customer').get(id=invoice_id)
 
+        # The PDF name is derived from the invoice, so it stays resolvable after
+        # the generate_invoice_pdf task row has been archived.
+        storage = invoice_storage()
         if document_path is None:
-            try:
-                recent_tasks = Task.objects.filter(name='send_invoice_email').order_by('-created_at')
-
-                current_task = None
-                for task in recent_tasks:
-                    import json
-                    try:
-                        args = json.loads(task.arguments)
-                        if args.get('args') and len(args['args']) > 0 and args['args'][0] == invoice_id:
-                            current_task = task
-                            break
-                    except (json.JSONDecodeError, TypeError, IndexError):
-                        continue
-
-                if current_task:
-                    pdf_task = current_task.dependencies.filter(name='generate_invoice_pdf').first()
-                    if pdf_task and pdf_task.status == 'completed' and pdf_task.result:
-                        document_path = pdf_task.result
-                        logger.info(f"Retrieved document path from dependency: {document_path}")
-
-                if document_path is None:
-                    pdf_tasks = Task.objects.filter(
-                        name='generate_invoice_pdf',
-                        status='completed'
-                    ).order_by('-completed_at')
-
-                    for task in pdf_tasks:
-                        try:
-                            args = json.loads(task.arguments)
-                            if args.get('args') and len(args['args']) > 0 and args['args'][0] == invoice_id:
-                                document_path = task.result
-                                logger.info(f"Retrieved document path from previous PDF task: {document_path}")
-                                break
-                        except (json.JSONDecodeError, TypeError, IndexError):
-                            continue
-
-                if document_path is None:
-                    pdf_dir = os.path.join(settings.BASE_DIR, 'invoice_pdfs')
-                    filename = f"invoice_{invoice.invoice_number.replace('-', '_')}.pdf"
-                    expected_path = os.path.join(pdf_dir, filename)
-
-                    if os.path.exists(expected_path):
-                        document_path = expected_path
-                        logger.info(f"Using expected document path: {document_path}")
-            except Exception as e:
-                logger.error(f"Error retrieving document path: {str(e)}")
+            with timed('document_lookup'):
+                expected_path = invoice_pdf_name(invoice)
+                if storage.exists(expected_path):
+                    document_path = expected_path
+                    logger.info("Using expected document path: %s", document_path)
 
         subject = f"Invoice {invoice.invoice_number}"
 
@@ -398,76 +412,61 @@ def send_invoice_email(invoice_id, document_path=None):
         )
         email.content_subtype = 'html'
 
-        if document_path:
-            logger.info(f"Attaching document: {document_path}")
-            email.attach_file(document_path)
-        elif hasattr(invoice, 'pdf_file') and invoice.pdf_file:
-            email.attach_file(invoice.pdf_file.path)
+        with timed('file_io'):
+            if document_path:
+                logger.info("Attaching document: %s", document_path)
+                with storage.open(document_path, 'rb') as f:
+                    email.attach(os.path.basename(document_path), f.read(), 'application/pdf')
+            elif hasattr(invoice, 'pdf_file') and invoice.pdf_file:
+                email.attach_file(invoice.pdf_file.path)
 
-        email.send(fail_silently=False)
+        with timed('smtp'):
+            email.send(fail_silently=False)
 
-        invoice.status = 'sent'
-        invoice.save()
+        with timed('db_write'):
+            invoice.status = 'sent'
+            invoice.save()
 
-        logger.info(f"Successfully sent invoice {invoice.invoice_number} to {settings.RECIPIENT_EMAIL}")
-        logger.info(f"Document attached: {document_path if document_path else 'None'}")
+        logger.info("Successfully sent invoice %s to %s", invoice.invoice_number, settings.RECIPIENT_EMAIL)
+        logger.info("Document attached: %s", document_path if document_path else 'None')
         return True
 
     except Invoice.DoesNotExist:
-        logger.error(f"Invoice with ID {invoice_id} does not exist")
+        logger.error("Invoice with ID %s does not exist", invoice_id)
         raise
     except Exception as e:
-        logger.error(f"Error sending invoice email: {str(e)}")
+        logger.error("Error sending invoice email: %s", e)
         raise
 
 
-@background_task(priority="medium",)
-def generate_daily_invoice_report():
-    logger.info("Starting daily invoice report generation")
+@background_task(priority="medium", queue=RENDER_QUEUE)
+@instrumented
+def generate_daily_invoice_report(logical_time=None, window_start=None):
+    from invoices.rendering import render_invoice_report
 
-    end_time = timezone.now()
-    start_time = end_time - timedelta(days=1)
-    recent_invoices = Invoice.objects.filter(
-        created_at__gte=start_time,
-        created_at__lt=end_time
-    )
+    # The dispatcher passes the scheduled time, so a late or backfilled run
+    # still reports its own window; a manual run covers the last 24 hours.
+    end_time = parse_time(logical_time) if logical_time else timezone.now()
+    start_time = parse_time(window_start) if window_start else end_time - timedelta(days=1)
+    logger.info("Starting daily invoice report generation for %s - %s", start_time, end_time)
+    with timed('db_load'):
+        recent_invoices = list(invoice_window(start_time, end_time).select_related('customer'))
 
-    reports_folder = os.path.join(settings.BASE_DIR, 'invoice_reports')
-    os.makedirs(reports_folder, exist_ok=True)
     report_filename = f"daily_invoice_report_{end_time.strftime('%Y%m%d')}.pdf"
-    report_path = os.path.join(reports_folder, report_filename)
-
-    doc = SimpleDocTemplate(report_path, pagesize=letter)
-    styles = getSampleStyleSheet()
-    elements = []
-
-    elements.append(Paragraph("Daily Invoice Report", styles['Heading1']))
-    elements.append(Paragraph(f"Period: {start_time.date()} – {end_time.date()}", styles['Normal']))
-    elements.append(Spacer(1, 0.2 * inch))
-
-    table_data = [["Invoice #", "Issue Date", "Customer", "Amount", "Status"]]
-    for inv in recent_invoices:
-        table_data.append([
-            inv.invoice_number,
-            str(inv.issue_date),
-            inv.customer.name,
-            f"{inv.total_amount:.2f}",
-            inv.get_status_display()
-        ])
-
-    table = Table(table_data, colWidths=[1.5*inch, 1.5*inch, 2.5*inch, 1*inch, 1*inch])
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (3, 1), (4, -1), 'RIGHT'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-    ]))
-    elements.append(table)
-    elements.append(Spacer(1, 0.3 * inch))
-    elements.append(Paragraph("End of report", styles['Normal']))
-
-    doc.build(elements)
-    logger.info(f"PDF saved at: {report_path}")
+    storage = invoice_storage()
+
+    # Large reports spill to disk instead of being held in memory.
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as report_file:
+        with timed('render'):
+            render_invoice_report(report_file, recent_invoices, start_time, end_time)
+        report_file.seek(0)
+        with timed('file_io'):
+            report_path = storage.save(
+                storage.shard('invoice_reports', report_filename, date=end_time.date()), File(report_file)
+            )
+        report_file.seek(0)
+        report_pdf = report_file.read()
+    logger.info("PDF saved at: %s", report_path)
 
     subject = "Daily Invoice Report"
     body = "Please find attached the invoice report for the last 24 hours."
@@ -477,8 +476,70 @@ def generate_daily_invoice_report():
         from_email=settings.DEFAULT_FROM_EMAIL,
         to=[settings.RECIPIENT_EMAIL],
     )
-    email.attach_file(report_path)
-    email.send(fail_silently=False)
-    logger.info(f"Report emailed to: {settings.RECIPIENT_EMAIL}")
+    email.attach(report_filename, report_pdf, 'application/pdf')
+    with timed('smtp'):
+        email.send(fail_silently=False)
+    logger.info("Report emailed to: %s", settings.RECIPIENT_EMAIL)
+
+    return report_path
+
+
+@background_task(priority="medium", queue=BOOKKEEPING_QUEUE)
+@instrumented
+def summarize_invoices(logical_time, window_start, shard=0, shards=1):
+    start_time, end_time = parse_time(window_start), parse_time(logical_time)
+    logger.info("Summarizing invoices for %s - %s (shard %s/%s)", start_time, end_time, shard + 1, shards)
+
+    with timed('db_load'):
+        invoices = shard_bounds(invoice_window(start_time, end_time), shard, shards)
+        rows = list(invoices.order_by().values('status').annotate(count=Count('id'), total=Sum('total_amount')))
+
+    # Keyed by window and shard, so a re-run overwrites its own row.
+    with timed('db_write'), transaction.atomic():
+        # Rows of an earlier run of this window with more shards would be summed twice.
+        InvoiceSummary.objects.filter(period_start=start_time, period_end=end_time, shard__gte=shards).delete()
+        InvoiceSummary.objects.update_or_create(
+            period_start=start_time,
+            period_end=end_time,
+            shard=shard,
+            defaults={
+                'shards': shards,
+                'invoice_count': sum(row['count'] for row in rows),
+                'total_amount': sum((row['total'] for row in rows), Decimal('0')),
+                'status_counts': {row['status']: row['count'] for row in rows},
+            },
+        )
+    return sum(row['count'] for row in rows)
+
+
+@background_task(priority="high", queue=BOOKKEEPING_QUEUE)
+@instrumented
+def dispatch_periodic_jobs():
+    return dispatch_due_jobs()
+
+
+# Archives of 100k PDFs take far longer than the default 5 minute task timeout.
+@background_task(priority="low", queue=RENDER_QUEUE, timeout=6 * 60 * 60)
+@instrumented
+def build_invoice_pdf_archive(name, date_from=None, date_to=None, statuses=None, customer_id=None):
+    from invoices.exports import filter_invoices
+    from invoices.pdf_archive import build_archive
+
+    logger.info("Building PDF archive %s", name)
+    invoices = filter_invoices(
+        date_from=date_from, date_to=date_to, statuses=statuses, customer_id=customer_id
+    )
+    path, counts = build_archive(invoices, name)
+    logger.info(
+        "PDF archive %s written to %s (%s cached, %s rendered, %s failed)",
+        name, path, counts['cached'], counts['rendered'], counts['failed'],
+    )
+    return path
+
+
+@background_task(priority="low", queue=BOOKKEEPING_QUEUE)
+@instrumented
+def archive_old_tasks():
+    from invoices.archival import archive_tasks
 
-    return report_path
\ No newline at end of file
+    return archive_tasks()
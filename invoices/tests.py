@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import csv
+import datetime
+import glob
+import gzip
+import hashlib
+import importlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from decimal import Decimal
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django_async_manager.models import Task
+
+from invoices import metrics, seeding, tasks
+from invoices.archival import archive_tasks
+from invoices.autoscale import Autoscaler, target_workers, task_cost_ratios, threads_fork_safely, worker_limit
+from invoices.bench import run_benchmarks
+from invoices.exports import CSV_HEADER, FORMATS, export_chunks, iter_invoice_rows
+from invoices.idempotency import enqueue_once
+from invoices.ingest import BatchIngest, MalformedPayload, clean_row, iter_json_rows
+from invoices.log import AsyncHandler
+from invoices.models import (
+    Customer, Invoice, InvoiceBatch, InvoiceItem, InvoiceSummary, PeriodicJobRun, TaskArchive,
+)
+from invoices.pdf_archive import MANIFEST_NAME, archive_name, build_archive
+from invoices.periodic import _enqueue, dispatch_due_jobs
+from invoices.storage import ShardedFileSystemStorage, invoice_storage, migrate_flat_files
+
+try:
+    from moto.server import ThreadedMotoServer
+    from invoices.storage_s3 import ShardedS3Storage
+except ImportError:
+    ShardedS3Storage = None
+
+
+class BenchmarkSuiteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.report = run_benchmarks(
+            customers=2, invoices_per_customer=2, items_per_invoice=2, iterations=2, report_iterations=1
+        )
+        cls.sent_emails = len(mail.outbox)
+
+    def test_reports_every_case(self):
+        self.assertEqual(set(self.report['results']), {
+            'generate_invoice',
+            'generate_invoice_pdf',
+            'send_invoice_email_chain',
+            'generate_daily_invoice_report',
+            'view_index',
+            'view_invoice_list',
+            'view_invoice_detail',
+            'view_customer_list',
+            'view_customer_detail',
+        })
+        for name, result in self.report['results'].items():
+            with self.subTest(name):
+                self.assertGreater(result['ops_per_s'], 0)
+                self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_query_budgets(self):
+        # Guards against N+1 regressions: these counts must not grow with the data volume.
+        budgets = {
+            'generate_invoice_pdf': 2,
+            'generate_daily_invoice_report': 1,
+            'view_index': 3,
+            'view_invoice_list': 2,
+            'view_invoice_detail': 2,
+            'view_customer_list': 1,
+            'view_customer_detail': 2,
+        }
+        for name, budget in budgets.items():
+            with self.subTest(name):
+                self.assertLessEqual(self.report['results'][name]['queries_per_op'], budget)
+
+    def test_sends_through_locmem_email_backend(self):
+        # Two invoice email chains plus one daily report.
+        self.assertEqual(self.sent_emails, 3)
+
+    def test_rerun_leaves_no_seeded_rows(self):
+        self.assertFalse(Customer.objects.exists())
+        run_benchmarks(customers=1, invoices_per_customer=1, items_per_invoice=1, iterations=1, report_iterations=1)
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(Customer.objects.exists())
+
+
+
+class SeedInvoicesTests(TestCase):
+    def seed(self, prefix):
+        call_command(
+            'seed_invoices', customers=3, invoices=12, chunk_size=5, seed=7, prefix=prefix,
+            with_tasks=True, stdout=io.StringIO(),
+        )
+
+    def test_rerun_with_another_prefix(self):
+        self.seed('A')
+        tasks = Task.objects.count()
+        self.seed('B')
+        self.assertEqual(Invoice.objects.filter(invoice_number__startswith='B-7-').count(), 12)
+        self.assertEqual(Task.objects.count(), 2 * tasks)
+        self.assertEqual(Customer.objects.count(), 6)
+
+    def test_rerun_with_the_same_prefix_creates_nothing(self):
+        self.seed('A')
+        counts = Customer.objects.count(), Invoice.objects.count(), Task.objects.count()
+        with self.assertRaises(CommandError):
+            self.seed('A')
+        self.assertEqual((Customer.objects.count(), Invoice.objects.count(), Task.objects.count()), counts)
+
+    def test_remove_seeded_undoes_a_run(self):
+        self.seed('A')
+        customer_ids = list(Customer.objects.values_list('id', flat=True))
+        seeding.remove_seeded('A', 7, customer_ids)
+        self.assertFalse(Customer.objects.exists())
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(Task.objects.exists())
+
+
+class AsyncHandlerTests(SimpleTestCase):
+    def test_forked_children_log_through_the_parent(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        filename = os.path.join(directory.name, 'worker.log')
+        handler = AsyncHandler(filename, console=False, max_bytes=4096, backup_count=100)
+        logger = logging.getLogger('invoices.tests.async_handler')
+        logger.addHandler(handler)
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        self.addCleanup(logger.removeHandler, handler)
+
+        context = multiprocessing.get_context('fork')
+        opened_file = context.Value('b', True)
+
+        def child():
+            for n in range(100):
+                logger.info('child %s', n, extra={'invoice': object()})
+            try:
+                1 / 0
+            except ZeroDivisionError:
+                logger.exception('child failed')
+            opened_file.value = handler.targets[0].stream is not None
+
+        process = context.Process(target=child)
+        process.start()
+        process.join()
+        for n in range(100):
+            logger.info('parent %s', n)
+        handler._stop_listeners()
+
+        entries = []
+        for path in glob.glob(f'{filename}*'):
+            with open(path) as f:
+                entries.extend(json.loads(line) for line in f)
+        self.assertGreater(len(glob.glob(f'{filename}*')), 1)
+        self.assertEqual(len(entries), 201)
+        self.assertFalse(opened_file.value)
+        child_entries = [entry for entry in entries if entry['pid'] == process.pid]
+        self.assertEqual(len(child_entries), 101)
+        failed = next(entry for entry in child_entries if entry['message'].startswith('child failed'))
+        self.assertIn('ZeroDivisionError', failed['message'])
+
+    def test_commands_exit_cleanly(self):
+        # Stopping the listeners at exit must not print anything, e.g. a thread
+        # that cannot be started during interpreter shutdown.
+        result = subprocess.run(
+            [sys.executable, 'manage.py', 'check'], cwd=settings.BASE_DIR, capture_output=True, text=True,
+            env={**os.environ, 'LOG_DIR': settings.LOG_DIR, 'LOG_CONSOLE': 'False'},
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stderr, '')
+
+
+class ArchiveTasksTests(TestCase):
+    def make_task(self, status, days_old=30, **fields):
+        return Task.objects.create(
+            name='generate_invoice_pdf', queue='invoices.render', arguments={'args': [1]}, status=status,
+            created_at=timezone.now() - datetime.timedelta(days=days_old), **fields,
+        )
+
+    def test_finished_tasks_are_copied_and_deleted(self):
+        done = [
+            self.make_task('completed', completed_at=timezone.now()),
+            self.make_task('failed', attempts=3, last_errors=['first', 'last']),
+            self.make_task('canceled'),
+        ]
+        self.assertEqual(archive_tasks(retention_days=14, chunk_size=2), 3)
+        self.assertFalse(Task.objects.exists())
+        archived = {row.task_id: row for row in TaskArchive.objects.all()}
+        self.assertEqual(set(archived), {task.id for task in done})
+        failed = archived[done[1].id]
+        self.assertEqual((failed.status, failed.attempts, failed.last_error), ('failed', 3, 'last'))
+        self.assertEqual(failed.arguments, {'args': [1]})
+
+    def test_active_recent_and_depended_on_tasks_stay(self):
+        kept = [
+            self.make_task('pending'),
+            self.make_task('in_progress'),
+            self.make_task('completed', days_old=1),
+        ]
+        dependency = self.make_task('completed')
+        kept[0].dependencies.add(dependency)
+        kept.append(dependency)
+
+        self.assertEqual(archive_tasks(retention_days=14, dry_run=True), 0)
+        self.assertEqual(archive_tasks(retention_days=14), 0)
+        self.assertEqual(set(Task.objects.values_list('id', flat=True)), {task.id for task in kept})
+        self.assertFalse(TaskArchive.objects.exists())
+
+    def test_rerun_is_idempotent(self):
+        for _ in range(5):
+            self.make_task('completed')
+        self.assertEqual(archive_tasks(retention_days=14, dry_run=True), 5)
+        self.assertEqual(archive_tasks(retention_days=14, chunk_size=2), 5)
+        self.assertEqual(archive_tasks(retention_days=14, chunk_size=2), 0)
+        self.assertEqual(TaskArchive.objects.count(), 5)
+        self.assertFalse(Task.objects.exists())
+
+# Cold-start budget for importing the ASGI app and the run_worker command,
+# as reported by ``python -X importtime`` (0.2-0.35s on a developer laptop).
+# Wall-clock time varies with machine load, so the check is opt-in.
+STARTUP_IMPORT_BUDGET = 0.5
+CHECK_STARTUP_BUDGET = os.environ.get('CHECK_STARTUP_BUDGET', '').lower() in ('1', 'true', 'yes')
+STARTUP_SCRIPT = """
+import django
+from django.db import connection
+queries = []
+def record(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+with connection.execute_wrapper(record):
+    django.setup()
+    import DjangoProject.asgi
+    import django_async_manager.management.commands.run_worker
+    from django.urls import get_resolver
+    get_resolver().url_patterns
+print(len(queries))
+"""
+LAZY_MODULES = ('reportlab', 'invoices.rendering')
+
+
+class StartupImportTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        env = {**os.environ, 'DJANGO_SETTINGS_MODULE': 'DjangoProject.settings', 'LOG_DIR': settings.LOG_DIR}
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True,
+        )
+        cls.queries = int(result.stdout)
+        # "import time: self [us] | cumulative | imported package", nested imports indented.
+        cls.imports = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'cumulative' in line:
+                continue
+            _, cumulative, name = line.split('|')
+            cls.imports.append((name[1:].rstrip(), int(cumulative) / 1e6))
+
+    def slowest(self, count=10):
+        ranked = sorted(self.imports, key=lambda entry: entry[1], reverse=True)[:count]
+        return '\n'.join(f'{seconds:8.3f}s {name}' for name, seconds in ranked)
+
+    def test_heavy_modules_load_lazily(self):
+        loaded = {name.strip() for name, _ in self.imports}
+        for module in LAZY_MODULES:
+            self.assertNotIn(module, loaded, f'{module} is imported at startup:\n{self.slowest()}')
+
+    @unittest.skipUnless(CHECK_STARTUP_BUDGET, 'set CHECK_STARTUP_BUDGET=1 to check the startup time budget')
+    def test_startup_import_budget(self):
+        total = sum(seconds for name, seconds in self.imports if not name.startswith(' '))
+        self.assertLess(total, STARTUP_IMPORT_BUDGET, f'Startup imports took {total:.3f}s:\n{self.slowest()}')
+
+    def test_startup_runs_no_queries(self):
+        # Unlike the time budget this does not depend on the machine.
+        self.assertEqual(self.queries, 0)
+
+
+def json_rows(body, read_size=4, max_row_bytes=1024):
+    return list(iter_json_rows(io.BytesIO(body), read_size=read_size, max_row_bytes=max_row_bytes))
+
+
+class IterJsonRowsTests(SimpleTestCase):
+    rows = [{'customer_id': 1, 'note': 'zażółć'}, {'customer_id': 2}, 3, 'x']
+
+    def test_array_and_ndjson(self):
+        array = json.dumps(self.rows, ensure_ascii=False).encode()
+        ndjson = '\n'.join(json.dumps(row, ensure_ascii=False) for row in self.rows).encode()
+        for name, body in (('array', array), ('ndjson', ndjson)):
+            with self.subTest(name):
+                # Every read size cuts rows, numbers and multi-byte characters somewhere.
+                for read_size in (1, 2, 3, 7, 64 * 1024):
+                    self.assertEqual(json_rows(body, read_size=read_size), self.rows)
+
+    def test_number_split_across_reads(self):
+        self.assertEqual(json_rows(b'12\n345', read_size=4), [12, 345])
+        self.assertEqual(json_rows(b'[12345]', read_size=2), [12345])
+
+    def test_empty_bodies(self):
+        self.assertEqual(json_rows(b''), [])
+        self.assertEqual(json_rows(b' [ ] '), [])
+
+    def test_malformed_bodies(self):
+        cases = {
+            b'[{"customer_id": 1}': 'Missing closing bracket',
+            b'[{"customer_id": 1}] {}': 'Unexpected data after the closing bracket',
+            b'{"customer_id": 1}\n{"customer_id": ': 'Invalid JSON',
+            b'{"note": "\xff"}': 'Body is not valid UTF-8',
+            b'{"note": "' + b'x' * 100 + b'"}': 'larger than 32 bytes',
+        }
+        for body, message in cases.items():
+            with self.subTest(body[:20]), self.assertRaisesMessage(MalformedPayload, message):
+                json_rows(body, max_row_bytes=32)
+
+
+class CleanRowTests(SimpleTestCase):
+    def row(self, **fields):
+        item = {'description': 'Hosting', 'quantity': 2, 'unit_price': 10.5, **fields.pop('item', {})}
+        return {'customer_id': 1, 'items': [item], **fields}
+
+    def test_valid_row(self):
+        self.assertEqual(
+            clean_row(self.row(due_days=14)),
+            (1, [{'description': 'Hosting', 'quantity': 2, 'unit_price': '10.5'}], 14),
+        )
+        self.assertEqual(clean_row(self.row())[2], 30)
+
+    def test_invalid_rows(self):
+        cases = {
+            'not an object': [],
+            'customer_id bool': self.row(customer_id=True),
+            'customer_id string': self.row(customer_id='1'),
+            'due_days out of range': self.row(due_days=3651),
+            'no items': {'customer_id': 1, 'items': []},
+            'item not an object': {'customer_id': 1, 'items': ['Hosting']},
+            'blank description': self.row(item={'description': ' '}),
+            'long description': self.row(item={'description': 'x' * 256}),
+            'zero quantity': self.row(item={'quantity': 0}),
+            'price not a number': self.row(item={'unit_price': 'ten'}),
+            'price not finite': self.row(item={'unit_price': 'NaN'}),
+            'negative price': self.row(item={'unit_price': -1}),
+            'price with 3 decimals': self.row(item={'unit_price': '1.005'}),
+        }
+        for name, row in cases.items():
+            with self.subTest(name), self.assertRaises(ValueError):
+                clean_row(row)
+
+
+@override_settings(BULK_INGEST_CHUNK_SIZE=2)
+class BulkIngestEndpointTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.customer = Customer.objects.create(name='Bulk', email='bulk@example.com', address='Street 1')
+
+    def post(self, body, content_type='application/x-ndjson'):
+        return self.client.post(reverse('bulk_create_invoices'), data=body, content_type=content_type)
+
+    def body(self, count, customer_id=None):
+        return '\n'.join(json.dumps({
+            'customer_id': customer_id or self.customer.id,
+            'items': [{'description': f'Item {n}', 'unit_price': '1.00'}],
+        }) for n in range(count)).encode()
+
+    def progress(self, batch_id):
+        return self.client.get(reverse('invoice_batch_status', args=[batch_id])).json()
+
+    def run_chunks(self):
+        chunks = Task.objects.filter(name='generate_invoices_bulk', status='pending')
+        for task in sorted(chunks, key=lambda task: task.arguments['args'][1]):
+            try:
+                tasks.generate_invoices_bulk.__wrapped__(*task.arguments['args'])
+            except Exception:
+                pass
+
+    def test_progress_until_completed(self):
+        body = self.body(3) + b'\n{"customer_id": 999999, "items": [{"description": "x", "unit_price": 1}]}\n[]'
+        response = self.post(body)
+        self.assertEqual(response.status_code, 202)
+        batch_id = response.json()['batch_id']
+        progress = self.progress(batch_id)
+        self.assertEqual(
+            {key: progress[key] for key in ('status', 'rows_received', 'rows_rejected', 'chunks_total', 'chunks_done')},
+            {'status': 'processing', 'rows_received': 5, 'rows_rejected': 2, 'chunks_total': 2, 'chunks_done': 0},
+        )
+        # Unknown customers are only found when their chunk is flushed.
+        self.assertEqual([error['row'] for error in progress['errors']], [3, 4])
+
+        self.run_chunks()
+        progress = self.progress(batch_id)
+        self.assertEqual((progress['status'], progress['chunks_done'], progress['invoices_created']), ('completed', 2, 3))
+        self.assertEqual(Invoice.objects.count(), 3)
+
+    def test_malformed_body_creates_nothing(self):
+        response = self.post(self.body(5) + b'\n{"customer_id": ')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Invalid JSON', response.json()['error'])
+        progress = self.progress(response.json()['batch_id'])
+        self.assertEqual((progress['status'], progress['chunks_total']), ('failed', 0))
+        self.assertFalse(Task.objects.exists())
+        self.run_chunks()
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_failed_chunk_fails_the_batch(self):
+        response = self.post(self.body(4))
+        batch_id = response.json()['batch_id']
+        first = next(task for task in Task.objects.all() if task.arguments['args'][1] == 0)
+        first.arguments['args'][2][0][2][0]['unit_price'] = 'not a price'
+        first.save(update_fields=['arguments'])
+        self.run_chunks()
+        progress = self.progress(batch_id)
+        self.assertEqual((progress['status'], progress['chunks_done']), ('failed', 0))
+        self.assertEqual([error.get('chunk') for error in progress['errors']], [0])
+
+    def test_read_error_fails_the_batch(self):
+        body = io.BytesIO(self.body(5))
+
+        class DroppedStream:
+            # Delivers the first read, then the client goes away.
+            reads = 0
+
+            def read(self, size=-1):
+                self.reads += 1
+                if self.reads > 1:
+                    raise OSError('Connection reset by peer')
+                return body.read(size)
+
+        batch = InvoiceBatch.objects.create()
+        with self.assertRaises(OSError):
+            BatchIngest(batch).run(DroppedStream())
+        batch.refresh_from_db()
+        # The last row has no trailing newline yet, so two chunks were held when the read failed.
+        self.assertEqual((batch.status, batch.rows_received, batch.chunks_total), ('failed', 4, 0))
+        self.assertEqual(batch.errors, [{'row': 4, 'error': 'OSError: Connection reset by peer'}])
+        self.assertFalse(Task.objects.exists())
+
+    def test_unsupported_content_type(self):
+        self.assertEqual(self.post(self.body(1), content_type='text/plain').status_code, 415)
+
+
+class InvoiceExportTests(TestCase):
+    # item counts per invoice; one invoice has none and still gets a CSV row.
+    ITEMS = (3, 0, 1, 2, 1)
+
+    @classmethod
+    def setUpTestData(cls):
+        customers = [
+            Customer.objects.create(name=f'Export {n}', email=f'export{n}@example.com', address='Street 1')
+            for n in range(2)
+        ]
+        for n, item_count in enumerate(cls.ITEMS):
+            invoice = Invoice.objects.create(
+                invoice_number=f'EXP-{n}', customer=customers[n % 2],
+                issue_date=datetime.date(2026, 1, 1 + n), due_date=datetime.date(2026, 2, 1),
+                status='paid' if n % 2 else 'sent', total_amount=Decimal('0'),
+            )
+            InvoiceItem.objects.bulk_create([
+                InvoiceItem(invoice=invoice, description=f'Item {n}.{i}', quantity=i + 1, unit_price=Decimal('2.50'))
+                for i in range(item_count)
+            ])
+
+    def export(self, fmt, compress=False, invoices=None):
+        return b''.join(export_chunks(invoices or Invoice.objects.all(), fmt, compress, page_size=2))
+
+    def test_keyset_pages_cover_every_row_once(self):
+        expected = list(iter_invoice_rows(Invoice.objects.all(), page_size=1000))
+        # Three pages of two invoices, each an id query and a row query, then an empty id query.
+        with self.assertNumQueries(7):
+            rows = list(iter_invoice_rows(Invoice.objects.all(), page_size=2))
+        self.assertEqual(rows, expected)
+        self.assertEqual(len(rows), sum(max(count, 1) for count in self.ITEMS))
+        self.assertEqual([row['id'] for row in rows], sorted(row['id'] for row in rows))
+
+    def test_csv(self):
+        lines = list(csv.reader(io.StringIO(self.export('csv').decode())))
+        self.assertEqual(tuple(lines[0]), CSV_HEADER)
+        self.assertEqual(len(lines) - 1, sum(max(count, 1) for count in self.ITEMS))
+        rows = [dict(zip(CSV_HEADER, line)) for line in lines[1:]]
+        self.assertEqual(
+            [(row['invoice_number'], row['item_description'], row['item_total']) for row in rows[:5]],
+            [('EXP-0', 'Item 0.0', '2.50'), ('EXP-0', 'Item 0.1', '5.00'), ('EXP-0', 'Item 0.2', '7.50'),
+             ('EXP-1', '', ''), ('EXP-2', 'Item 2.0', '2.50')],
+        )
+        self.assertEqual(rows[0]['customer_name'], 'Export 0')
+
+    def test_ndjson(self):
+        records = [json.loads(line) for line in self.export('ndjson').decode().splitlines()]
+        self.assertEqual([record['invoice_number'] for record in records], [f'EXP-{n}' for n in range(5)])
+        self.assertEqual([len(record['items']) for record in records], list(self.ITEMS))
+        self.assertEqual(records[0]['items'][1], {'description': 'Item 0.1', 'quantity': 2, 'unit_price': '2.50'})
+        self.assertEqual(records[1]['customer']['name'], 'Export 1')
+
+    def test_gzip(self):
+        for fmt in FORMATS:
+            with self.subTest(fmt):
+                self.assertEqual(gzip.decompress(self.export(fmt, compress=True)), self.export(fmt))
+
+    def test_view_filters_and_compresses(self):
+        response = self.client.get(reverse('export_invoices'), {
+            'format': 'ndjson', 'status': 'paid', 'date_from': '2026-01-02', 'gzip': '1',
+        })
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual([json.loads(line)['invoice_number'] for line in lines], ['EXP-1', 'EXP-3'])
+
+    def test_view_rejects_bad_parameters(self):
+        for params in ({'format': 'xml'}, {'date_from': '2026-13-01'}, {'customer': 'abc'}):
+            with self.subTest(params):
+                self.assertEqual(self.client.get(reverse('export_invoices'), params).status_code, 400)
+
+
+class PdfArchiveTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name='Archive', email='archive@example.com', address='Street 1')
+        cls.invoices = [
+            Invoice.objects.create(
+                invoice_number=f'ARC-{n}', customer=customer, due_date=datetime.date(2026, 2, 1),
+                status='sent', total_amount=Decimal('10.00'),
+            )
+            for n in range(3)
+        ]
+        for invoice in cls.invoices:
+            InvoiceItem.objects.create(invoice=invoice, description='Hosting', quantity=1, unit_price=Decimal('10.00'))
+
+    def storage_settings(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        return {'BACKEND': 'invoices.storage.ShardedFileSystemStorage', 'OPTIONS': {'location': directory.name}}
+
+    def setUp(self):
+        override = override_settings(STORAGES={**settings.STORAGES, 'invoice_files': self.storage_settings()})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.storage = invoice_storage()
+        # The first invoice already has its PDF; the others are rendered.
+        self.storage.save(tasks.invoice_pdf_name(self.invoices[0]), ContentFile(b'%PDF-1.4 cached'))
+
+    def build(self):
+        target, counts = build_archive(Invoice.objects.all(), 'test', chunk_size=2, processes=1)
+        with self.storage.open(target) as f, zipfile.ZipFile(f) as archive:
+            files = {name: archive.read(name) for name in archive.namelist()}
+        manifest = list(csv.DictReader(io.StringIO(files.pop(MANIFEST_NAME).decode())))
+        return target, counts, files, manifest
+
+    def test_manifest_describes_every_pdf(self):
+        target, counts, files, manifest = self.build()
+        self.assertEqual(target, archive_name('test'))
+        self.assertEqual(counts, {'cached': 1, 'rendered': 2, 'failed': 0})
+        self.assertEqual([row['invoice_number'] for row in manifest], ['ARC-0', 'ARC-1', 'ARC-2'])
+        self.assertEqual([row['source'] for row in manifest], ['cached', 'rendered', 'rendered'])
+        self.assertEqual(set(files), {row['file'] for row in manifest})
+        for row in manifest:
+            with self.subTest(row['file']):
+                content = files[row['file']]
+                self.assertTrue(content.startswith(b'%PDF'))
+                self.assertEqual(int(row['size']), len(content))
+                self.assertEqual(row['sha256'], hashlib.sha256(content).hexdigest())
+                self.assertEqual((row['customer'], row['total_amount'], row['error']), ('Archive', '10.00', ''))
+
+    def test_rerun_reuses_rendered_pdfs(self):
+        _, _, first_files, _ = self.build()
+        _, counts, files, manifest = self.build()
+        self.assertEqual(counts, {'cached': 3, 'rendered': 0, 'failed': 0})
+        self.assertEqual({row['source'] for row in manifest}, {'cached'})
+        self.assertEqual(files, first_files)
+        self.assertEqual(self.storage.listdir('invoice_archives')[1], ['test.zip'])
+
+
+
+@unittest.skipIf(ShardedS3Storage is None, 'needs django-storages[s3] and moto[server]')
+class S3PdfArchiveTests(PdfArchiveTests):
+    # The archive streams into a multipart upload instead of a local file.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def storage_settings(self):
+        host, port = self.server.get_host_and_port()
+        return {'BACKEND': 'invoices.storage_s3.ShardedS3Storage', 'OPTIONS': {
+            'bucket_name': 'invoice-files', 'endpoint_url': f'http://{host}:{port}', 'region_name': 'us-east-1',
+            'access_key': 'test', 'secret_key': 'test',
+        }}
+
+    def setUp(self):
+        # Create the bucket before PdfArchiveTests.setUp stores the cached PDF.
+        ShardedS3Storage(**self.storage_settings()['OPTIONS']).connection.meta.client.create_bucket(
+            Bucket='invoice-files'
+        )
+        super().setUp()
+
+
+class MigrateFlatFilesTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.root = directory.name
+        self.storage = ShardedFileSystemStorage(location=self.root)
+        self.flat = {
+            'invoice_pdfs/invoice_INV_1.pdf': b'%PDF-1.4',
+            'invoice_reports/daily_invoice_report_20260714.pdf': b'%PDF-1.4 report',
+            'customer_communications/customer_1.json': json.dumps({'communications': [{'invoice_id': 1}]}).encode(),
+        }
+        for name, content in self.flat.items():
+            os.makedirs(os.path.join(self.root, os.path.dirname(name)), exist_ok=True)
+            with open(os.path.join(self.root, name), 'wb') as f:
+                f.write(content)
+
+    def read(self, name):
+        with self.storage.open(name, 'rb') as f:
+            return f.read()
+
+    def test_moves_files_to_their_sharded_names(self):
+        history = self.storage.shard('customer_communications', 'customer_1.json')
+        # Written after the deploy, before the migration ran.
+        self.storage.save(history, ContentFile(json.dumps({'communications': [{'invoice_id': 2}]})))
+
+        self.assertEqual(list(migrate_flat_files(self.root, self.storage, dry_run=True)), [
+            ('invoice_pdfs/invoice_INV_1.pdf', self.storage.shard('invoice_pdfs', 'invoice_INV_1.pdf')),
+            ('customer_communications/customer_1.json', history),
+            ('invoice_reports/daily_invoice_report_20260714.pdf',
+             'invoice_reports/2026/07/14/daily_invoice_report_20260714.pdf'),
+        ])
+        self.assertTrue(all(os.path.exists(os.path.join(self.root, name)) for name in self.flat))
+
+        moved = dict(migrate_flat_files(self.root, self.storage))
+        self.assertFalse(any(os.path.exists(os.path.join(self.root, name)) for name in self.flat))
+        self.assertEqual(self.read(moved['invoice_pdfs/invoice_INV_1.pdf']), b'%PDF-1.4')
+        self.assertEqual(self.read(moved['invoice_reports/daily_invoice_report_20260714.pdf']), b'%PDF-1.4 report')
+        self.assertEqual(
+            json.loads(self.read(history))['communications'], [{'invoice_id': 1}, {'invoice_id': 2}]
+        )
+        self.assertEqual(list(migrate_flat_files(self.root, self.storage)), [])
+
+SUMMARY_JOB = {
+    'task': 'invoices.tasks.summarize_invoices',
+    'cron': '0 * * * *',
+    'window': datetime.timedelta(hours=1),
+    'catchup': 3,
+    'shard_rows': 2,
+    'max_shards': 16,
+}
+
+
+@override_settings(PERIODIC_JOBS={'summary': SUMMARY_JOB})
+class PeriodicJobTests(TestCase):
+    now = datetime.datetime(2026, 10, 19, 12, 30, tzinfo=datetime.timezone.utc)
+    hour = datetime.timedelta(hours=1)
+
+    @classmethod
+    def setUpTestData(cls):
+        customer = Customer.objects.create(name='Periodic', email='periodic@example.com', address='Street 1')
+        # Five invoices in the 11:00-12:00 window, one in the window before.
+        for n, created_at in enumerate([cls.now - datetime.timedelta(minutes=m) for m in (35, 40, 45, 50, 55, 95)]):
+            invoice = Invoice.objects.create(
+                invoice_number=f'PER-{n}', customer=customer, due_date=datetime.date(2026, 11, 1),
+                status='paid' if n % 2 else 'sent', total_amount=Decimal(n + 1),
+            )
+            Invoice.objects.filter(pk=invoice.pk).update(created_at=created_at)
+
+    def summary_tasks(self):
+        return sorted(
+            (task.arguments['kwargs'] for task in Task.objects.filter(name='summarize_invoices')),
+            key=lambda kwargs: (kwargs['logical_time'], kwargs['shard']),
+        )
+
+    def start_ledger(self, logical_time):
+        PeriodicJobRun.objects.create(job='summary', logical_time=logical_time, shards=0)
+
+    def test_new_job_starts_its_ledger_without_running(self):
+        self.assertEqual(dispatch_due_jobs(self.now), 0)
+        run = PeriodicJobRun.objects.get(job='summary')
+        self.assertEqual((run.logical_time, run.shards), (self.now.replace(minute=0), 0))
+        self.assertFalse(Task.objects.exists())
+
+    def test_duplicate_dispatch_coalesces(self):
+        self.start_ledger(self.now.replace(minute=0) - self.hour)
+        self.assertEqual(dispatch_due_jobs(self.now), 3)
+        self.assertEqual(dispatch_due_jobs(self.now), 0)
+        # Another dispatcher racing for the same slot hits the ledger's unique constraint.
+        self.assertEqual(_enqueue('summary', SUMMARY_JOB, self.now.replace(minute=0)), 0)
+        self.assertEqual(Task.objects.count(), 3)
+
+    def test_catch_up_after_downtime(self):
+        self.start_ledger(self.now.replace(minute=0) - 5 * self.hour)
+        # Five hourly slots were missed; the catch-up limit keeps the latest three.
+        dispatch_due_jobs(self.now)
+        slots = [self.now.replace(minute=0) - n * self.hour for n in (2, 1, 0)]
+        self.assertEqual(
+            list(PeriodicJobRun.objects.filter(shards__gt=0).order_by('logical_time').values_list('logical_time', flat=True)),
+            slots,
+        )
+        self.assertEqual(
+            sorted({kwargs['logical_time'] for kwargs in self.summary_tasks()}),
+            [slot.isoformat() for slot in slots],
+        )
+
+    def test_shards_cover_the_window_once(self):
+        self.start_ledger(self.now.replace(minute=0) - self.hour)
+        dispatch_due_jobs(self.now)
+        shards = [kwargs for kwargs in self.summary_tasks() if kwargs['logical_time'] == self.now.replace(minute=0).isoformat()]
+        # Five invoices at two rows per shard.
+        self.assertEqual([(kwargs['shard'], kwargs['shards']) for kwargs in shards], [(0, 3), (1, 3), (2, 3)])
+        for kwargs in shards:
+            tasks.summarize_invoices.__wrapped__(**kwargs)
+        rows = InvoiceSummary.objects.filter(period_end=self.now.replace(minute=0))
+        self.assertEqual(sum(row.invoice_count for row in rows), 5)
+        self.assertEqual(sum(row.total_amount for row in rows), Decimal(1 + 2 + 3 + 4 + 5))
+
+    def test_fewer_shards_replace_the_old_layout(self):
+        end = self.now.replace(minute=0)
+        window = {'logical_time': end.isoformat(), 'window_start': (end - self.hour).isoformat()}
+        for shard in range(3):
+            tasks.summarize_invoices.__wrapped__(**window, shard=shard, shards=3)
+        tasks.summarize_invoices.__wrapped__(**window, shard=0, shards=1)
+        rows = InvoiceSummary.objects.filter(period_end=end)
+        self.assertEqual([(row.shard, row.shards, row.invoice_count) for row in rows], [(0, 1, 5)])
+
+
+class AutoscalePolicyTests(SimpleTestCase):
+    def test_task_cost_ratio(self):
+        snapshot = {
+            'cpu_seconds': {'send_invoice_email': 0.5, 'generate_invoice_pdf': 3.6},
+            'histograms': {
+                'send_invoice_email|total': {'sum': 10.0, 'count': 20},
+                'generate_invoice_pdf|total': {'sum': 4.0, 'count': 20},
+            },
+        }
+        self.assertEqual(task_cost_ratios(snapshot), {'send_invoice_email': 0.05, 'generate_invoice_pdf': 0.9})
+
+    def test_cpu_bound_queue_is_capped_at_core_count(self):
+        self.assertEqual(worker_limit(0.9, 1, 32, cpu_count=4, cpu_bound_ratio=0.5), 4)
+
+    def test_io_bound_queue_gets_more_workers_than_cores(self):
+        self.assertEqual(worker_limit(0.05, 1, 32, cpu_count=4, cpu_bound_ratio=0.5), 32)
+        self.assertEqual(worker_limit(0.25, 1, 32, cpu_count=4, cpu_bound_ratio=0.5), 16)
+
+    def test_grows_to_backlog_and_shrinks_one_at_a_time(self):
+        self.assertEqual(target_workers(current=2, pending=40, limit=16, min_workers=1), 16)
+        self.assertEqual(target_workers(current=16, pending=0, limit=16, min_workers=1), 15)
+        self.assertEqual(target_workers(current=1, pending=0, limit=16, min_workers=1), 1)
+
+
+class FakePool:
+    # Records the sizes the autoscaler asks for instead of starting workers.
+    def __init__(self, queue, poll_interval):
+        self.queue = queue
+        self.size = 0
+        self.processes = False
+        self.stopped = False
+
+    def resize(self, target, processes=False):
+        self.size, self.processes = target, processes
+
+    def stop(self, timeout=None):
+        self.stopped = True
+
+
+class FakePoolAutoscaler(Autoscaler):
+    pool_class = FakePool
+
+
+class AutoscalerTests(TestCase):
+    topology = {
+        'q.render': {'workers': 1, 'min_workers': 1, 'max_workers': 4},
+        'q.mail': {'workers': 2, 'min_workers': 1, 'max_workers': 8},
+    }
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(TASK_METRICS_FILE=os.path.join(directory.name, 'metrics.json'))
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.reset()
+        self.scaler = FakePoolAutoscaler(list(self.topology), self.topology)
+        self.scaler.cpu_count = 2
+
+    def enqueue(self, queue, count, name='task', status='pending'):
+        Task.objects.bulk_create([
+            Task(name=name, queue=queue, arguments={}, status=status, completed_at=timezone.now())
+            for _ in range(count)
+        ])
+
+    def gauge(self, name):
+        return metrics.load()['gauges'][name]
+
+    def test_starts_at_the_configured_sizes(self):
+        self.assertEqual({queue: pool.size for queue, pool in self.scaler.pools.items()}, {'q.render': 1, 'q.mail': 2})
+
+    def test_grows_with_the_backlog_and_shrinks_one_at_a_time(self):
+        self.enqueue('q.mail', 20)
+        self.assertEqual(self.scaler.step(), {'q.render': 1, 'q.mail': 8})
+        self.assertEqual(self.gauge('invoice_queue_pending_tasks'), {'q.render': 0, 'q.mail': 20})
+        self.assertEqual(self.gauge('invoice_queue_worker_limit'), {'q.render': 4, 'q.mail': 8})
+
+        Task.objects.update(status='completed')
+        sizes = [self.scaler.step()['q.mail'] for _ in range(8)]
+        self.assertEqual(sizes, [7, 6, 5, 4, 3, 2, 1, 1])
+        self.assertEqual(self.scaler.pools['q.mail'].size, 1)
+        self.assertEqual(self.gauge('invoice_queue_workers'), {'q.render': 1, 'q.mail': 1})
+
+    def test_cost_profile_caps_cpu_bound_queues(self):
+        # render_pdf spends 90% of its wall time on CPU, send_mail 10%.
+        with open(settings.TASK_METRICS_FILE, 'w') as f:
+            json.dump({
+                'histograms': {
+                    'render_pdf|total': {'buckets': [], 'sum': 10.0, 'count': 10},
+                    'send_mail|total': {'buckets': [], 'sum': 10.0, 'count': 10},
+                },
+                'queries': {}, 'cpu_seconds': {'render_pdf': 9.0, 'send_mail': 1.0}, 'gauges': {},
+            }, f)
+        self.enqueue('q.render', 5, 'render_pdf', 'completed')
+        self.enqueue('q.mail', 5, 'send_mail', 'completed')
+        self.enqueue('q.render', 10)
+        self.enqueue('q.mail', 10)
+
+        # CPU-bound: the core count; I/O-bound: ceil(2 cores / 0.1), capped at max_workers.
+        self.assertEqual(self.scaler.step(), {'q.render': 2, 'q.mail': 8})
+        self.assertTrue(self.scaler.pools['q.render'].processes)
+        self.assertEqual(self.gauge('invoice_queue_cpu_ratio'), {'q.render': 0.9, 'q.mail': 0.1})
+        self.assertEqual(self.gauge('invoice_task_cpu_ratio'), {'render_pdf': 0.9, 'send_mail': 0.1})
+        self.assertEqual(self.gauge('invoice_queue_worker_processes')['q.render'], 1)
+
+    def test_sqlite_pools_run_processes(self):
+        # Neither queue asks for processes; only a fork-safe database gets threads.
+        processes = not threads_fork_safely()
+        self.assertEqual(processes, connection.vendor == 'sqlite')
+        self.assertEqual(
+            {queue: pool.processes for queue, pool in self.scaler.pools.items()},
+            {'q.render': processes, 'q.mail': processes},
+        )
+
+    def test_run_stops_the_pools(self):
+        stop = threading.Event()
+        stop.set()
+        self.scaler.run(stop)
+        self.assertTrue(all(pool.stopped for pool in self.scaler.pools.values()))
+
+POSTGRES_ENV = {
+    'DB_ENGINE': 'postgresql',
+    'DB_NAME': 'postgres',
+    'DB_HOST': os.environ.get('DB_HOST', 'localhost'),
+    'DB_PORT': os.environ.get('DB_PORT', '5432'),
+    'DB_USER': os.environ.get('DB_USER', 'postgres'),
+    'DB_PASSWORD': os.environ.get('DB_PASSWORD', ''),
+    'DB_POOL': 'True',
+}
+# Settings read the management command from sys.argv.
+POOL_SETTING_SCRIPT = """
+import sys
+sys.argv[:] = ['manage.py', sys.argv[1]]
+from DjangoProject import settings
+print('pool' in settings.DATABASES['default']['OPTIONS'])
+"""
+FORK_SCRIPT = """
+import multiprocessing
+import django
+django.setup()
+from django.db import connection
+
+def backend_pid():
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_backend_pid()')
+        return cursor.fetchone()[0]
+
+def child(queue):
+    queue.put(backend_pid())
+
+parent = backend_pid()
+context = multiprocessing.get_context('fork')
+queue = context.Queue()
+process = context.Process(target=child, args=(queue,))
+process.start()
+forked = queue.get(timeout=30)
+process.join()
+print(parent, forked, backend_pid(), 'pool' in connection.settings_dict['OPTIONS'])
+"""
+
+
+def postgres_available():
+    try:
+        import psycopg
+        psycopg.connect(
+            host=POSTGRES_ENV['DB_HOST'], port=POSTGRES_ENV['DB_PORT'], user=POSTGRES_ENV['DB_USER'],
+            password=POSTGRES_ENV['DB_PASSWORD'], dbname=POSTGRES_ENV['DB_NAME'], connect_timeout=2,
+        ).close()
+    except Exception:
+        return False
+    return True
+
+
+class PostgresProfileTests(SimpleTestCase):
+    # Runs the PostgreSQL profile in a subprocess against DB_HOST/DB_PORT/DB_USER.
+
+    def run_python(self, code, *argv):
+        env = {
+            **os.environ, **POSTGRES_ENV, 'DJANGO_SETTINGS_MODULE': 'DjangoProject.settings',
+            'LOG_DIR': settings.LOG_DIR, 'LOG_CONSOLE': 'False',
+        }
+        result = subprocess.run(
+            [sys.executable, '-c', code, *argv],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return result.stdout.split()
+
+    def test_worker_commands_do_not_pool(self):
+        self.assertEqual(self.run_python(POOL_SETTING_SCRIPT, 'run_worker_pools'), ['False'])
+        self.assertEqual(self.run_python(POOL_SETTING_SCRIPT, 'runserver'), ['True'])
+
+    @unittest.skipUnless(postgres_available(), 'needs a reachable PostgreSQL server')
+    def test_forked_child_opens_its_own_connection(self):
+        parent, forked, after, pooled = self.run_python(FORK_SCRIPT)
+        self.assertEqual(pooled, 'True')
+        self.assertNotEqual(forked, parent)
+        # The parent's session survives the child exiting.
+        self.assertEqual(after, parent)
+
+
+@unittest.skipUnless(settings.DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3', 'SQLite profile')
+class SqliteProfileTests(SimpleTestCase):
+    # Opens connections with the configured settings against a scratch file,
+    # since the test database lives in memory.
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'profile.sqlite3')
+
+    def open(self, alias):
+        settings_dict = {**connections['default'].settings_dict, 'NAME': self.path}
+        connection = connections.create_connection('default')
+        connection.settings_dict = settings_dict
+        connection.alias = alias
+        connections[alias] = connection
+        return connection
+
+    def test_connections_apply_the_pragmas(self):
+        connection = self.open('profile')
+        self.addCleanup(connection.close)
+        with connection.cursor() as cursor:
+            pragmas = {}
+            for name in ('journal_mode', 'synchronous', 'busy_timeout'):
+                cursor.execute(f'PRAGMA {name}')
+                pragmas[name] = cursor.fetchone()[0]
+        self.assertEqual(pragmas, {
+            'journal_mode': settings.SQLITE_PRAGMAS['journal_mode'].lower(),
+            # NORMAL
+            'synchronous': 1,
+            'busy_timeout': settings.SQLITE_PRAGMAS['busy_timeout'],
+        })
+
+    def test_concurrent_writer_waits_for_the_lock(self):
+        first = self.open('first')
+        self.addCleanup(first.close)
+        with first.cursor() as cursor:
+            cursor.execute('CREATE TABLE probe (id INTEGER PRIMARY KEY, writer TEXT)')
+
+        first_reading = threading.Event()
+        outcome = {}
+
+        def second_writer():
+            connection = self.open('second')
+            first_reading.wait()
+            try:
+                # Read, then write: the same shape as a worker claiming a task.
+                with transaction.atomic(using='second'):
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT COUNT(*) FROM probe')
+                        cursor.execute("INSERT INTO probe (writer) VALUES ('second')")
+            except OperationalError as e:
+                outcome['error'] = e
+            outcome['finished'] = time.monotonic()
+            connection.close()
+
+        thread = threading.Thread(target=second_writer)
+        thread.start()
+        with transaction.atomic(using='first'):
+            with first.cursor() as cursor:
+                cursor.execute('SELECT COUNT(*) FROM probe')
+                first_reading.set()
+                time.sleep(0.3)
+                cursor.execute("INSERT INTO probe (writer) VALUES ('first')")
+        committed = time.monotonic()
+        thread.join()
+
+        self.assertNotIn('error', outcome)
+        self.assertGreaterEqual(outcome['finished'], committed)
+        with first.cursor() as cursor:
+            cursor.execute('SELECT writer FROM probe ORDER BY id')
+            self.assertEqual([row[0] for row in cursor.fetchall()], ['first', 'second'])
+
+
+class RequeueLegacyTasksTests(TestCase):
+    def test_pending_tasks_move_to_the_split_queues(self):
+        migration = importlib.import_module('invoices.migrations.0006_requeue_legacy_tasks')
+        mail = Task.objects.create(name='send_invoice_email', queue='invoices', arguments={})
+        report = Task.objects.create(name='generate_daily_invoice_report', queue='default', arguments={})
+        done = Task.objects.create(name='generate_invoice_pdf', queue='invoices', arguments={}, status='completed')
+
+        migration.requeue_legacy_tasks(apps, None)
+
+        self.assertEqual(Task.objects.get(pk=mail.pk).queue, 'invoices.mail')
+        self.assertEqual(Task.objects.get(pk=report.pk).queue, 'invoices.render')
+        self.assertEqual(Task.objects.get(pk=done.pk).queue, 'invoices')
+
+
+class EnqueueOnceTests(TestCase):
+    @staticmethod
+    def enqueue(invoice_id):
+        return Task.objects.create(name='send_invoice_email', queue='invoices.mail', arguments={'args': [invoice_id]})
+
+    def test_duplicate_key_returns_the_same_task(self):
+        task, created = enqueue_once('send:1:v1', self.enqueue, 1)
+        duplicate, created_again = enqueue_once('send:1:v1', self.enqueue, 1)
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(duplicate.id, task.id)
+        self.assertEqual(Task.objects.count(), 1)
+
+    def test_key_is_reusable_once_the_task_finishes(self):
+        for status in ('completed', 'failed', 'canceled'):
+            with self.subTest(status):
+                task, _ = enqueue_once(f'send:2:{status}', self.enqueue, 2)
+                Task.objects.filter(pk=task.pk).update(status=status)
+                again, created = enqueue_once(f'send:2:{status}', self.enqueue, 2)
+                self.assertTrue(created)
+                self.assertNotEqual(again.id, task.id)
+
+    def test_running_task_still_blocks(self):
+        task, _ = enqueue_once('send:3:v1', self.enqueue, 3)
+        Task.objects.filter(pk=task.pk).update(status='in_progress')
+        self.assertEqual(enqueue_once('send:3:v1', self.enqueue, 3), (task, False))
+
+
+class TestOutputTests(SimpleTestCase):
+    def test_logs_and_metrics_stay_out_of_the_tree(self):
+        # Tasks called directly by other tests record metrics and log without overrides.
+        for path in (settings.LOG_DIR, settings.TASK_METRICS_FILE):
+            with self.subTest(path):
+                self.assertTrue(path.startswith(settings.TEST_OUTPUT_DIR))
+                self.assertNotEqual(os.path.commonpath([path, settings.BASE_DIR]), str(settings.BASE_DIR))
+
+
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(TASK_METRICS_FILE=os.path.join(directory.name, 'metrics.json'))
+        override.enable()
+        self.addCleanup(override.disable)
+        metrics.reset()
+
+    def test_observations_land_in_their_buckets(self):
+        for duration in (0.003, 0.2, 0.25, 100):
+            metrics.record('send_invoice_email', 'smtp', duration, queries=2)
+        histogram = metrics.load()['histograms']['send_invoice_email|smtp']
+        self.assertEqual(histogram['buckets'][metrics.BUCKETS.index(0.005)], 1)
+        self.assertEqual(histogram['buckets'][metrics.BUCKETS.index(0.25)], 2)
+        self.assertEqual(histogram['buckets'][-1], 1)
+        self.assertEqual(histogram['count'], 4)
+        self.assertAlmostEqual(histogram['sum'], 100.453)
+        self.assertEqual(metrics.quantile(histogram, 0.5), 0.25)
+        self.assertEqual(metrics.quantile(histogram, 0.99), float('inf'))
+
+    def test_flush_merges_into_the_existing_file(self):
+        metrics.record('generate_invoice_pdf', 'render', 0.02, queries=1)
+        metrics.set_gauge('invoice_queue_workers', 'invoices.render', 2)
+        metrics.flush()
+        metrics.record('generate_invoice_pdf', 'render', 0.04, queries=3)
+        metrics.set_gauge('invoice_queue_workers', 'invoices.render', 4)
+        metrics.flush()
+
+        with open(settings.TASK_METRICS_FILE) as f:
+            stored = json.load(f)
+        self.assertEqual(stored['histograms']['generate_invoice_pdf|render']['count'], 2)
+        self.assertAlmostEqual(stored['histograms']['generate_invoice_pdf|render']['sum'], 0.06)
+        self.assertEqual(stored['queries']['generate_invoice_pdf|render'], 4)
+        # Counters add up, gauges keep the latest value.
+        self.assertEqual(stored['gauges']['invoice_queue_workers'], {'invoices.render': 4})
+
+    def test_prometheus_output(self):
+        metrics.record('generate_invoice_pdf', 'render', 0.02, queries=1)
+        metrics.record('generate_invoice_pdf', 'render', 0.3)
+        metrics.set_gauge('invoice_queue_workers', 'invoices.render', 2)
+        lines = metrics.render_prometheus().splitlines()
+        labels = 'task="generate_invoice_pdf",stage="render"'
+
+        self.assertIn('# TYPE invoice_task_stage_seconds histogram', lines)
+        # Buckets are cumulative and end with +Inf equal to the count.
+        self.assertIn(f'invoice_task_stage_seconds_bucket{{{labels},le="0.01"}} 0', lines)
+        self.assertIn(f'invoice_task_stage_seconds_bucket{{{labels},le="0.025"}} 1', lines)
+        self.assertIn(f'invoice_task_stage_seconds_bucket{{{labels},le="0.5"}} 2', lines)
+        self.assertIn(f'invoice_task_stage_seconds_bucket{{{labels},le="+Inf"}} 2', lines)
+        self.assertIn(f'invoice_task_stage_seconds_sum{{{labels}}} 0.320000', lines)
+        self.assertIn(f'invoice_task_stage_seconds_count{{{labels}}} 2', lines)
+        self.assertIn(f'invoice_task_stage_queries_total{{{labels}}} 1', lines)
+        self.assertIn('# TYPE invoice_queue_workers gauge', lines)
+        self.assertIn('invoice_queue_workers{queue="invoices.render"} 2', lines)
+
+    def test_forked_child_starts_with_a_fresh_lock_and_no_pending_metrics(self):
+        metrics.record('generate_invoice_pdf', 'render', 0.02)
+        with metrics._lock:
+            pid = os.fork()
+            if pid == 0:
+                clean = metrics._lock.acquire(timeout=5) and not metrics._pending['histograms']
+                os._exit(0 if clean else 1)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+
+class ShardedStorageContract:
+    # Shared checks; subclasses provide self.storage.
+
+    def test_hash_layout_is_stable(self):
+        name = self.storage.shard('invoice_pdfs', 'invoice_INV_1.pdf')
+        self.assertRegex(name, r'^invoice_pdfs/[0-9a-f]{2}/[0-9a-f]{2}/invoice_INV_1\.pdf$')
+        self.assertEqual(name, self.storage.shard('invoice_pdfs', 'invoice_INV_1.pdf'))
+
+    def test_date_layout(self):
+        name = self.storage.shard('invoice_reports', 'report.pdf', date=datetime.date(2026, 7, 3))
+        self.assertEqual(name, 'invoice_reports/2026/07/03/report.pdf')
+
+    def test_save_replaces_existing_file(self):
+        name = self.storage.shard('customer_communications', 'customer_1.json')
+        self.assertEqual(self.storage.save(name, ContentFile(b'first')), name)
+        self.assertEqual(self.storage.save(name, ContentFile(b'second')), name)
+        with self.storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), b'second')
+
+
+class ShardedFileSystemStorageTests(ShardedStorageContract, SimpleTestCase):
+    def setUp(self):
+        self.location = tempfile.TemporaryDirectory()
+        self.addCleanup(self.location.cleanup)
+        self.storage = ShardedFileSystemStorage(location=self.location.name)
+
+    def test_no_temporary_files_left_behind(self):
+        name = self.storage.shard('invoice_pdfs', 'invoice_INV_2.pdf')
+        self.storage.save(name, ContentFile(b'%PDF'))
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))), ['invoice_INV_2.pdf'])
+
+    def test_failed_write_keeps_previous_file(self):
+        name = self.storage.shard('invoice_pdfs', 'invoice_INV_3.pdf')
+        self.storage.save(name, ContentFile(b'old'))
+
+        class Broken(ContentFile):
+            def chunks(self, chunk_size=None):
+                yield b'partial'
+                raise OSError('disk full')
+
+        with self.assertRaises(OSError):
+            self.storage.save(name, Broken(b''))
+        with self.storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        self.assertEqual(os.listdir(os.path.dirname(self.storage.path(name))), ['invoice_INV_3.pdf'])
+
+
+@unittest.skipIf(ShardedS3Storage is None, 'needs django-storages[s3] and moto[server]')
+class ShardedS3StorageTests(ShardedStorageContract, SimpleTestCase):
+    # Runs against moto's S3-compatible server as a local stand-in for the bucket.
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadedMotoServer(ip_address='127.0.0.1', port=0)
+        cls.server.start()
+        host, port = cls.server.get_host_and_port()
+        cls.endpoint_url = f'http://{host}:{port}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.storage = ShardedS3Storage(
+            bucket_name='invoice-files',
+            endpoint_url=self.endpoint_url,
+            region_name='us-east-1',
+            access_key='test',
+            secret_key='test',
+        )
+        self.storage.connection.meta.client.create_bucket(Bucket='invoice-files')
+
+    def test_aborted_stream_keeps_previous_file(self):
+        name = self.storage.shard('invoice_archives', 'aborted.zip')
+        self.storage.save(name, ContentFile(b'old'))
+        f = self.storage.open(name, 'wb')
+        f.write(b'partial')
+        self.storage.abort_write(f)
+        with self.storage.open(name, 'rb') as f:
+            self.assertEqual(f.read(), b'old')
@@ -7,10 +7,15 @@ urlpatterns = [
     path('invoices/', views.invoice_list, name='invoice_list'),
     path('invoices/<int:invoice_id>/', views.invoice_detail, name='invoice_detail'),
     path('invoices/create/', views.create_invoice, name='create_invoice'),
+    path('invoices/export/', views.export_invoices, name='export_invoices'),
     path('invoices/<int:invoice_id>/send/', views.send_invoice, name='send_invoice'),
+    path('invoices/bulk/', views.bulk_create_invoices, name='bulk_create_invoices'),
+    path('invoices/batches/<uuid:batch_id>/', views.invoice_batch_status, name='invoice_batch_status'),
 
     path('customers/', views.customer_list, name='customer_list'),
     path('customers/<int:customer_id>/', views.customer_detail, name='customer_detail'),
 
     path('tasks/<int:task_id>/', views.task_status, name='task_status'),
+
+    path('metrics/', views.task_metrics, name='task_metrics'),
 ]
@@ -1,10 +1,16 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from django.core.paginator import Paginator
+from django.utils.dateparse import parse_date
 
-from .models import Customer, Invoice, InvoiceItem
+from .exports import FORMATS, export_chunks, export_filename, filter_invoices
+from .idempotency import enqueue_once
+from .ingest import BatchIngest, MalformedPayload, batch_progress
+from .metrics import render_prometheus
+from .models import Customer, Invoice, InvoiceBatch
 from .tasks import generate_invoice, send_invoice_email
 
 def index(request):
@@ -48,6 +54,36 @@ def invoice_detail(request, invoice_id):
     
     return render(request, 'invoices/invoice_detail.html', context)
 
+@require_GET
+def export_invoices(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in FORMATS:
+        return JsonResponse({'error': f"format must be one of: {', '.join(FORMATS)}"}, status=400)
+    
+    filters = {}
+    for param in ('date_from', 'date_to'):
+        value = request.GET.get(param)
+        if value:
+            try:
+                filters[param] = parse_date(value)
+            except ValueError:
+                filters[param] = None
+            if filters[param] is None:
+                return JsonResponse({'error': f'{param} must be a YYYY-MM-DD date'}, status=400)
+    statuses = [status for status in request.GET.get('status', '').split(',') if status]
+    customer_id = request.GET.get('customer')
+    if customer_id and not customer_id.isdigit():
+        return JsonResponse({'error': 'customer must be a customer id'}, status=400)
+    
+    compress = request.GET.get('gzip') in ('1', 'true')
+    invoices = filter_invoices(statuses=statuses, customer_id=customer_id, **filters)
+    response = StreamingHttpResponse(
+        export_chunks(invoices, fmt, compress),
+        content_type='application/gzip' if compress else FORMATS[fmt],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(fmt, compress)}"'
+    return response
+
 def customer_list(request):
     customers = Customer.objects.all().order_by('name')
     
@@ -98,16 +134,50 @@ def create_invoice(request):
     
     return render(request, 'invoices/create_invoice.html', context)
 
+BULK_CONTENT_TYPES = ('application/json', 'application/x-ndjson', 'application/jsonl')
+
+# Machine-to-machine endpoint for the ERP integration: takes a JSON array or
+# NDJSON body of {"customer_id", "items", "due_days"} rows and streams it from
+# the socket, so the payload is never held in memory.
+@csrf_exempt
+@require_POST
+def bulk_create_invoices(request):
+    if request.content_type not in BULK_CONTENT_TYPES:
+        return JsonResponse(
+            {'error': f"Content-Type must be one of: {', '.join(BULK_CONTENT_TYPES)}"}, status=415
+        )
+    
+    batch = InvoiceBatch.objects.create()
+    try:
+        BatchIngest(batch).run(request)
+    except MalformedPayload as exc:
+        batch.refresh_from_db()
+        return JsonResponse({**batch_progress(batch), 'error': str(exc)}, status=400)
+    
+    batch.refresh_from_db()
+    return JsonResponse(batch_progress(batch), status=202)
+
+@require_GET
+def invoice_batch_status(request, batch_id):
+    batch = get_object_or_404(InvoiceBatch, id=batch_id)
+    return JsonResponse(batch_progress(batch))
+
 @require_POST
 def send_invoice(request, invoice_id):
     invoice = get_object_or_404(Invoice, id=invoice_id)
     
-    task = send_invoice_email(invoice_id)
+    # Sending marks the invoice as sent, which bumps updated_at, so the key
+    # only collapses repeated clicks on the same version of the invoice.
+    idempotency_key = f'send:{invoice.id}:{invoice.updated_at.isoformat()}'
+    task, created = enqueue_once(idempotency_key, send_invoice_email, invoice_id)
     
-    messages.success(request, f'Email sending started (Task ID: {task.id})')
+    if created:
+        messages.success(request, f'Email sending started (Task ID: {task.id})')
+    else:
+        messages.info(request, f'Email sending already in progress (Task ID: {task.id})')
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-        return JsonResponse({'status': 'success', 'task_id': task.id})
+        return JsonResponse({'status': 'success', 'task_id': task.id, 'duplicate': not created})
     
     return redirect('invoice_detail', invoice_id=invoice_id)
 
@@ -129,4 +199,7 @@ def task_status(request, task_id):
         'task': task,
     }
     
-    return render(request, 'invoices/task_status.html', context)
\ No newline at end of file
+    return render(request, 'invoices/task_status.html', context)
+
+def task_metrics(request):
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')